@@ -0,0 +1,195 @@
+# Copyright 2019 Vladislav Pavkin
+
+import asyncio
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+
+class Overloaded(Exception):
+    # a request was turned away to keep the route servers responsive
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ClientLimiter:
+    # a token bucket per client: `rate` requests per second, bursts of up to `burst`
+    #
+    # buckets that refilled up to the burst are the same as no bucket at all,
+    # they are dropped once more than max_clients clients are known; if that
+    # is not enough, the clients seen longest ago are dropped too, so at most
+    # max_clients buckets are kept whatever the number of clients
+
+    def __init__(self, rate=2, burst=20, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+
+        self.allowed = 0
+        self.limited = 0
+
+        self._buckets = OrderedDict()  # client -> [tokens, time of the last refill], oldest first
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, client, now=None):
+        # raises Overloaded when the client has no tokens left
+        now = now or monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= self.max_clients:
+                    self._prune(now)
+                bucket = self._buckets[client] = [self.burst, now]
+            else:
+                self._buckets.move_to_end(client)
+
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                self.limited += 1
+                raise Overloaded('Too many requests from %s' % client, retry_after=int((1 - tokens) / self.rate) + 1)
+
+            bucket[0] = tokens - 1
+            self.allowed += 1
+
+    def _prune(self, now):
+        full_after = self.burst / self.rate
+        for client in [client for client, (tokens, stamp) in self._buckets.items() if now - stamp >= full_after]:
+            del self._buckets[client]
+        while len(self._buckets) >= self.max_clients:
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'clients': len(self._buckets),
+                'allowed': self.allowed,
+                'limited': self.limited,
+            }
+
+
+class CommandBudget:
+    # at most `concurrency` commands running on a route server at once
+    #
+    # up to `queue` more wait for a slot, for `timeout` seconds at most;
+    # anything beyond that is rejected at once instead of piling up on BIRD
+
+    def __init__(self, name, concurrency=8, queue=32, timeout=2):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+        self._slots = BoundedSemaphore(concurrency)
+        self._lock = Lock()
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self._enqueue()
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                self._dequeue()
+            if not acquired:
+                self._time_out()
+        self._start()
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                raise Overloaded('%s is busy' % self.name)
+            self.waiting += 1
+            self.queued += 1
+
+    def _dequeue(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def _time_out(self):
+        with self._lock:
+            self.timed_out += 1
+        raise Overloaded('%s is busy' % self.name)
+
+    def _start(self):
+        with self._lock:
+            self.running += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._lock:
+            self.running -= 1
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue': self.queue,
+                'running': self.running,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+class AsyncCommandBudget(CommandBudget):
+    # CommandBudget for coroutines of one event loop, used with `async with`
+    #
+    # a queued coroutine waits on an asyncio semaphore, so waiting for a slot
+    # takes no thread; the semaphore is made on the loop of the first command
+
+    def __init__(self, name, concurrency=8, queue=32, timeout=2):
+        super().__init__(name, concurrency=concurrency, queue=queue, timeout=timeout)
+        self._slots = None
+
+    def acquire(self):
+        raise TypeError('%s is acquired with async with' % self.name)
+
+    async def acquire_async(self):
+        if self._slots is None:
+            self._slots = asyncio.BoundedSemaphore(self.concurrency)
+
+        if self._slots.locked():
+            self._enqueue()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self._time_out()
+            finally:
+                self._dequeue()
+        else:
+            await self._slots.acquire()
+        self._start()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,126 @@
+# Copyright 2019 Vladislav Pavkin
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from uuid import uuid4
+
+from paramiko.ssh_exception import SSHException
+
+from admission import AsyncCommandBudget
+from models import BATCH_SEPARATOR, Route, RouteServer
+
+READ_SIZE = 65536
+
+
+class AsyncRouteServer(RouteServer):
+    # RouteServer with coroutines in place of the blocking lookups
+    #
+    # every command runs on its own channel of the one SSH session; opening
+    # the channel is a short round trip done on one of `openers` threads, the
+    # output is then awaited on the channel's file descriptor, so a slow BIRD
+    # answer takes no thread at all.
+    #
+    # the whole table dumps of table() stay on RouteServer
+    #
+    # a dropped session is replaced once under a lock, the openers that saw
+    # it drop wait for that and go on with the new one
+
+    def __init__(self, server=None, budget=None, timeout=5, openers=32):
+        self.timeout = timeout
+        # threads opening channels; a handful stalls every lookup behind the round trips
+        self._openers = ThreadPoolExecutor(max_workers=openers, thread_name_prefix='open')
+        self._connecting = Lock()
+        super().__init__(server=server, budget=budget or AsyncCommandBudget(server))
+
+    async def _cmd(self, command):
+        # raises Overloaded when the server runs as many commands as its budget allows
+        async with self.budget:
+            loop = asyncio.get_running_loop()
+            channel = await loop.run_in_executor(self._openers, self._open, command)
+            try:
+                return await self._read(loop, channel)
+            finally:
+                channel.close()
+
+    def _open(self, command):
+        session = self._session
+        transport = session.get_transport()
+        if transport is None or not transport.is_active():
+            transport = self._reconnect(session)
+
+        try:
+            channel = transport.open_session(timeout=self.timeout)
+        except (TimeoutError, SSHException):
+            channel = self._reconnect(session).open_session(timeout=self.timeout)
+
+        channel.exec_command(command)
+        return channel
+
+    def _reconnect(self, session):
+        # the transport of a new session, `session` is the one that failed
+        with self._connecting:
+            if self._session is session:
+                session.close()
+                self.connect()
+            transport = self._session.get_transport()
+        if transport is None:
+            raise SSHException('No session to %s' % self.server)
+        return transport
+
+    async def _read(self, loop, channel) -> str:
+        # the channel's pipe is readable while it has unread data or once it is closed
+        readable = asyncio.Event()
+        fileno = channel.fileno()
+        loop.add_reader(fileno, readable.set)
+
+        chunks = []
+        try:
+            while True:
+                await asyncio.wait_for(readable.wait(), self.timeout)
+                readable.clear()
+
+                while channel.recv_ready():
+                    chunks.append(channel.recv(READ_SIZE))
+                while channel.recv_stderr_ready():
+                    channel.recv_stderr(READ_SIZE)
+
+                if channel.eof_received and not channel.recv_ready():
+                    break
+        finally:
+            loop.remove_reader(fileno)
+
+        return b''.join(chunks).decode('utf-8')
+
+    async def _cmds(self, commands) -> list:
+        separator = BATCH_SEPARATOR % uuid4().hex
+        bird_dump = await self._cmd(self._batch_command(commands, separator))
+        return self._split_batch(bird_dump, separator, len(commands))
+
+    async def route(self, destination=None, service=None, ip_version=None):
+        if self._session is None:
+            return
+
+        bird_dump = await self._cmd(self._route_command(destination, service))
+        return Route(dump=bird_dump, ip_version=ip_version)
+
+    async def peers(self, service='wix', ip_version=4) -> list:
+        if self._session is None:
+            return []
+
+        bird_dump = await self._cmd(self._peers_command(service))
+        return self._parse_peers(bird_dump, ip_version)
+
+    async def peer_routes(self, peer_id, rejected, service=None, ip_version=None):
+        if self._session is None:
+            return None, []
+
+        peer_dump, routes_dump = await self._cmds(self._peer_routes_commands(peer_id, rejected, service, ip_version))
+        return self._parse_peer_routes(peer_dump, routes_dump, rejected, ip_version)
+
+    async def protocol_routes(self, peer_id, rejected=False, service=None, ip_version=None) -> list:
+        if self._session is None:
+            return []
+
+        dump = await self._cmd(self._routes_command(peer_id, rejected, service, ip_version))
+        return self._parse_routes(dump, rejected, ip_version)
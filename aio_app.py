@@ -0,0 +1,179 @@
+# Copyright 2019 Vladislav Pavkin
+#
+# The route and peer routes lookups as an ASGI application, on AsyncRouteServer.
+# One process holds hundreds of lookups waiting on BIRD without a thread
+# for each; the pages are the ones app.py renders, from the same templates,
+# with the request checks and template contexts of helpers.py both apps use.
+#
+#   uvicorn aio_app:app --port <your_async_port>
+#
+# Everything else (summary, the peer page and its route history, live updates,
+# indexes, diffs) stays on app.py, see conf/apache_vhost.conf for what goes where.
+
+import asyncio
+import os
+import re
+from urllib.parse import parse_qs
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+import config
+from admission import Overloaded
+from aio import AsyncRouteServer
+from helpers import (PageError, async_command_budget, client_address, client_limiter, peer_routes_page, peer_routes_query,
+                     route_page, route_query, search_location)
+from route_cache import RouteCache
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+templates = Environment(loader=FileSystemLoader(TEMPLATES),
+                        autoescape=select_autoescape(['html']),
+                        bytecode_cache=FileSystemBytecodeCache(getattr(config, 'TEMPLATE_CACHE_DIR', None)))
+
+rs1 = AsyncRouteServer(server=config.SERVERS['rs1'], budget=async_command_budget('rs1'))
+rs2 = AsyncRouteServer(server=config.SERVERS['rs2'], budget=async_command_budget('rs2'))
+
+limiter = client_limiter()
+
+route_cache = RouteCache({'rs1': rs1, 'rs2': rs2},
+                         size=getattr(config, 'ROUTE_CACHE_SIZE', 10000),
+                         ttl=getattr(config, 'ROUTE_CACHE_TTL', 60))
+
+
+class Request:
+    # what the views need of an ASGI http scope, named as on flask.request
+
+    def __init__(self, scope):
+        self.path = scope['path']
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+        self.args = {name: values[0] for name, values in query.items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+
+
+class Response:
+
+    def __init__(self, body='', status=200, headers=None, content_type='text/html; charset=utf-8'):
+        self.body = body.encode('utf-8')
+        self.status = status
+        self.headers = dict(headers or {})
+        self.headers['Content-Type'] = content_type
+        self.headers['Content-Length'] = str(len(self.body))
+
+    async def send(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in self.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def render_template(template_name, **context) -> Response:
+    return Response(templates.get_template(template_name).render(context))
+
+
+def redirect(location) -> Response:
+    return Response(status=302, headers={'Location': location})
+
+
+def maintenance():
+    return render_template('page__maintenance.html', maintenance_text=config.MAINTENANCE_TEXT)
+
+
+async def route(request, service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    try:
+        given_prefix, destination, ip_version = route_query(service, request)
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
+
+    kwargs = {'destination': destination, 'service': service, 'ip_version': ip_version}
+    rs1_route, rs2_route = await asyncio.gather(route_cache.route_async('rs1', **kwargs),
+                                                route_cache.route_async('rs2', **kwargs))
+
+    return render_template('page__route.html',
+                           **route_page(service, ip_version, given_prefix, rs1, rs2, rs1_route, rs2_route))
+
+
+async def peer_prefixes(request, service, peer_id):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    try:
+        rejected_mode, ip_version = peer_routes_query(service, peer_id, request)
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
+
+    rs1_result, rs2_result = await asyncio.gather(
+        rs1.peer_routes(peer_id, rejected_mode, service=service, ip_version=ip_version),
+        rs2.peer_routes(peer_id, rejected_mode, service=service, ip_version=ip_version))
+
+    return render_template('page__peer_routes.html',
+                           **peer_routes_page(service, ip_version, peer_id, rejected_mode, rs1, rs2,
+                                              rs1_result, rs2_result))
+
+
+async def search(request):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    try:
+        return redirect(search_location(request))
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
+
+
+ROUTES = [
+    (re.compile(r'^/(?P<service>\w+)/route/$'), route),
+    (re.compile(r'^/(?P<service>\w+)/peer/(?P<peer_id>[^/]+)/routes/$'), peer_prefixes),
+    (re.compile(r'^/search/$'), search),
+]
+
+
+async def dispatch(request) -> Response:
+    for pattern, view in ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+
+        try:
+            limiter.take(client_address(request.remote_addr, request.headers.get('x-forwarded-for')))
+            response = await view(request, **match.groupdict())
+        except Overloaded as e:
+            response = render_template('error.html', error=e)
+            response.status = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+
+        if isinstance(response, tuple):
+            # (response, status) as a flask view returns it
+            response, status = response
+            response.status = status
+        return response
+
+    response = render_template('error.html', error='Page not found')
+    response.status = 404
+    return response
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    response = await dispatch(Request(scope))
+    await response.send(send)
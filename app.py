@@ -1,25 +1,58 @@
 # Copyright 2019 Vladislav Pavkin
 
-import ipaddress
+import json
 import pickle
-import re
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
+from itertools import islice
 from threading import Thread
+from time import time
 
+import click
 import sentry_sdk
-from flask import Flask, render_template, request, redirect
+from flask import Flask, Response, jsonify, render_template, request, redirect, stream_with_context
+from jinja2 import FileSystemBytecodeCache
 from sentry_sdk.integrations.flask import FlaskIntegration
 
 import config
-from models import RouteServer
+from admission import Overloaded
+from export import EXPORT_FORMATS, ExportStats, export
+from helpers import (PageError, adopt_prefix, client_address, client_limiter, command_budget, export_budget, get_family,
+                     peer_id_is_valid, peer_routes_page, peer_routes_query, route_page, route_query, search_location)
+from journal import PeerJournal
+from live import SummaryFeed
+from models import Community, RouteServer, Summary
+from route_cache import RouteCache
+from route_diff import ATTRIBUTES, RouteDiff, RouteSet
+from route_history import RouteHistory, sparkline
+from route_index import RouteIndexes, community_key, parse_community
 
 if config.SENTRY_KEY:
     sentry_sdk.init(dsn=config.SENTRY_KEY, integrations=[FlaskIntegration()])
 
 app = Flask(__name__)
 
-rs1 = RouteServer(server=config.SERVERS['rs1'])
-rs2 = RouteServer(server=config.SERVERS['rs2'])
+# compiled templates are kept on disk, so workers load bytecode instead of parsing them
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(getattr(config, 'TEMPLATE_CACHE_DIR', None))
+
+rs1 = RouteServer(server=config.SERVERS['rs1'], budget=command_budget('rs1'))
+rs2 = RouteServer(server=config.SERVERS['rs2'], budget=command_budget('rs2'))
+
+limiter = client_limiter()
+
+exports = export_budget()
+
+journal = PeerJournal(size=getattr(config, 'JOURNAL_SIZE', 10000))
+
+route_history = RouteHistory(size=getattr(config, 'ROUTE_HISTORY_SIZE', 40000))
+
+route_indexes = RouteIndexes({'rs1': rs1, 'rs2': rs2},
+                             interval=getattr(config, 'INDEX_INTERVAL', 600),
+                             full_every=getattr(config, 'INDEX_FULL_EVERY', 24))
+
+route_cache = RouteCache({'rs1': rs1, 'rs2': rs2},
+                         size=getattr(config, 'ROUTE_CACHE_SIZE', 10000),
+                         ttl=getattr(config, 'ROUTE_CACHE_TTL', 60))
 
 try:
     f = open('next_hop_map.pickle', 'rb')
@@ -32,9 +65,10 @@ else:
 
 
 class GetParallel:
-    results = [[None, None], [None, None]]
 
     def __init__(self, rs1_func=None, rs2_func=None, func_args=None, func_kwargs=None) -> None:
+        self.results = [None, None]
+        self.errors = [None, None]
         self.functions = [rs1_func, rs2_func]
         self.func_args = func_args or []
         self.func_kwargs = func_kwargs or {}
@@ -46,17 +80,61 @@ class GetParallel:
         task1.join()
         task2.join()
 
+        # a busy route server fails the whole request, see overloaded()
+        for error in self.errors:
+            if error is not None:
+                raise error
+
     def exec(self, idx: int) -> None:
         func = self.functions[idx]
-        result = func(*self.func_args, **self.func_kwargs)
-        self.results[idx] = result
+        try:
+            result = func(*self.func_args, **self.func_kwargs)
+        except Overloaded as e:
+            self.errors[idx] = e
+        else:
+            self.results[idx] = result
+
+
+# endpoints that never reach the route servers
+UNLIMITED_ENDPOINTS = {'static', 'route_cache_stats', 'admission_stats', 'peer_history',
+                       'route_history_stats'}
+
+
+@app.before_request
+def limit_clients():
+    if request.endpoint not in UNLIMITED_ENDPOINTS:
+        limiter.take(client_address(request.remote_addr, request.headers.get('X-Forwarded-For')))
+
 
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    if '/json/' in request.path or request.endpoint == 'export_table':
+        response = jsonify(error=str(e))
+    else:
+        response = app.make_response(render_template('error.html', error=e))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
-def peer_id_is_valid(peer_id: str) -> bool:
-    peer_re = re.compile(r'^peer_\d{4,6}$')
-    if peer_re.match(peer_id):
-        return True
-    return False
+
+def render_page(template_name, **context):
+    # pages with large tables are sent as they render when STREAM_TEMPLATES is on
+    if not getattr(config, 'STREAM_TEMPLATES', False):
+        return render_template(template_name, **context)
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.generate(context)))
+
+
+@app.template_filter('datetime')
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# templates are compiled at start, not by the first requests
+for template_name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+    app.jinja_env.get_template(template_name)
 
 
 def maintenance():
@@ -81,70 +159,378 @@ def peers(service):
 
     ip_version = get_family(request)
 
-    parallel = GetParallel(rs1_func=rs1.peers,
-                           rs2_func=rs2.peers,
-                           func_kwargs={'service': service, 'ip_version': ip_version})
+    pairs = fetch_summary(service, ip_version)
+    stream_seq = feed.publish(service, ip_version, pairs)
 
-    pairs = peers_pairs(parallel.results[0], parallel.results[1])
+    summary = Summary(pairs)
 
     # filter neighbors with hidden as
     if config.HIDDEN_PEER_AS:
-        filtered_pairs = []
-        for pair in pairs:
-            if pair['neighbor_as'] in config.HIDDEN_PEER_AS:
-                continue
-            filtered_pairs.append(pair)
-        pairs = filtered_pairs
+        summary.hide_asns(config.HIDDEN_PEER_AS)
 
     # filter by interval arg
-    interval = None
     given_interval = request.args.get('interval', '')
-    if given_interval.isdigit():
-        interval = int(given_interval)
-
-    if interval:
-        filtered_pairs = []
-        now = datetime.now()
-        delta = timedelta(minutes=interval)
-        for pair in pairs:
-            rs1_data = pair.get('rs1')
-            rs2_data = pair.get('rs2')
-            rs1_last_time = datetime.strptime(rs1_data.last_event_time, '%Y-%m-%d %H:%M:%S')
-            rs2_last_time = datetime.strptime(rs2_data.last_event_time, '%Y-%m-%d %H:%M:%S')
-            if now - rs1_last_time < delta:
-                filtered_pairs.append(pair)
-                continue
-            if now - rs2_last_time < delta:
-                filtered_pairs.append(pair)
-                continue
-        pairs = filtered_pairs
+    if given_interval.isdigit() and int(given_interval):
+        summary.changed_within(minutes=int(given_interval))
 
     # filter by status arg
-    status = None
     given_status = request.args.get('status', '')
     if given_status in ['up', 'down']:
-        status = given_status
-    if status:
-        filtered_pairs = []
-        for pair in pairs:
-            rs1_data = pair.get('rs1')
-            rs2_data = pair.get('rs2')
-            if rs1_data.state == status:
-                filtered_pairs.append(pair)
-                continue
-            if rs2_data.state == status:
-                filtered_pairs.append(pair)
-                continue
-        pairs = filtered_pairs
-
-    return render_template('page__summary.html',
-                           pairs=pairs,
+        summary.with_state(given_status)
+
+    now = time()
+    pairs = summary.rows(now)
+
+    return render_page('page__summary.html',
+                       pairs=pairs,
+                       now=now,
+                       service=service,
+                       family=ip_version,
+                       stream_seq=stream_seq,
+                       page='summary',
+                       welcome_text=config.WELCOME_TEXT)
+
+
+@app.route('/<service>/summary/stream/')
+def peers_stream(service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    if service not in ['fv', 'wix']:
+        return render_template('error.html', error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    # every open stream holds a server thread
+    if feed.is_full():
+        raise Overloaded('Too many live summaries open', retry_after=feed.interval)
+
+    given_seq = request.headers.get('Last-Event-ID') or request.args.get('seq', '')
+    seq = int(given_seq) if given_seq.isdigit() else 0
+
+    response = Response(feed.stream(service, ip_version, seq), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/<service>/changes/')
+def changes(service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    if service not in ['fv', 'wix']:
+        return render_template('error.html', error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    peer_id = request.args.get('peer_id', None)
+    if peer_id and not peer_id_is_valid(peer_id):
+        return render_template('error.html', error='Invalid peer format'), 404
+
+    hidden_asns = set(config.HIDDEN_PEER_AS or [])
+    events = journal.recent(service=service, ip_version=ip_version, peer_id=peer_id, hidden_asns=hidden_asns)
+    flaps = journal.flaps(service=service, ip_version=ip_version, hidden_asns=hidden_asns)
+
+    return render_template('page__changes.html',
+                           service=service,
+                           family=ip_version,
+                           peer_id=peer_id,
+                           events=events,
+                           flaps=sorted(flaps.items(), key=lambda x: x[1], reverse=True),
+                           page='summary',
+                           welcome_text=config.WELCOME_TEXT)
+
+
+def index_page(results):
+    # one page of RouteIndex search results and the 'after' cursor of the next page
+    limit = getattr(config, 'INDEX_PAGE_SIZE', 1000)
+    prefixes = list(islice(results, limit + 1))
+    next_after = prefixes[limit - 1][0] if len(prefixes) > limit else None
+    return prefixes[:limit], next_after
+
+
+def index_json(prefix, paths):
+    return {
+        'prefix': prefix,
+        'paths': [{'rs': rs, 'peer_id': peer_id, 'as_path': as_path} for rs, peer_id, as_path in paths],
+    }
+
+
+def community_search(service, ip_version):
+    # shared by the community page and its json twin
+    given_community = request.args.get('community', '').strip()
+    if not given_community:
+        return None
+
+    asn, value = parse_community(given_community)
+    index = route_indexes.get(service, ip_version)
+    found, results = index.search('community', community_key(asn, value), after=request.args.get('after'))
+    prefixes, next_after = index_page(results)
+    return {
+        'community': '%s,%s' % (asn, value),
+        'description': Community('%s,%s' % (asn, value)).description,
+        'updated': index.updated,
+        'found': found,
+        'prefixes': prefixes,
+        'next_after': next_after,
+    }
+
+
+def aspath_search(service, ip_version):
+    # (query, RouteIndex, paths found, results) for origin=, asn= or regex= arguments
+    index = route_indexes.get(service, ip_version)
+    after = request.args.get('after')
+
+    for kind in ['origin', 'asn']:
+        given_asn = request.args.get(kind, '').strip().upper().replace('AS', '')
+        if given_asn:
+            if not given_asn.isdigit():
+                raise ValueError('Wrong AS number given: %s' % given_asn)
+            found, results = index.search(kind, int(given_asn), after=after)
+            return {'kind': kind, 'query': given_asn}, index, found, results
+
+    given_regex = request.args.get('regex', '').strip()
+    if given_regex:
+        found, results = index.search_regex(given_regex, after=after,
+                                            timeout=getattr(config, 'ASPATH_SEARCH_TIMEOUT', 10))
+        return {'kind': 'regex', 'query': given_regex}, index, found, results
+
+    return None
+
+
+@app.route('/<service>/community/')
+def community(service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    if service not in ['fv', 'wix']:
+        return render_template('error.html', error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        result = community_search(service, ip_version)
+    except ValueError as e:
+        return render_template('error.html', error=e, service=service)
+
+    return render_template('page__community.html',
+                           service=service,
+                           family=ip_version,
+                           result=result,
+                           community_string=request.args.get('community', ''),
+                           page='summary',
+                           welcome_text=config.WELCOME_TEXT)
+
+
+@app.route('/<service>/community/json/')
+def community_json(service):
+    if config.MAINTENANCE:
+        return jsonify(error=config.MAINTENANCE_TEXT), 503
+
+    if service not in ['fv', 'wix']:
+        return jsonify(error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        result = community_search(service, ip_version)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if result is None:
+        return jsonify(error='No community given'), 400
+
+    result['prefixes'] = [index_json(prefix, paths) for prefix, paths in result['prefixes']]
+    return jsonify(result)
+
+
+@app.route('/<service>/aspath/')
+def aspath(service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    if service not in ['fv', 'wix']:
+        return render_template('error.html', error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        search_result = aspath_search(service, ip_version)
+    except ValueError as e:
+        return render_template('error.html', error=e, service=service)
+
+    result = None
+    if search_result:
+        query, index, found, results = search_result
+        prefixes, next_after = index_page(results)
+        result = dict(query, updated=index.updated, found=found, prefixes=prefixes, next_after=next_after)
+
+    return render_template('page__aspath.html',
+                           service=service,
+                           family=ip_version,
+                           result=result,
+                           args=request.args,
+                           page='summary',
+                           welcome_text=config.WELCOME_TEXT)
+
+
+@app.route('/<service>/aspath/json/')
+def aspath_json(service):
+    if config.MAINTENANCE:
+        return jsonify(error=config.MAINTENANCE_TEXT), 503
+
+    if service not in ['fv', 'wix']:
+        return jsonify(error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        search_result = aspath_search(service, ip_version)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if search_result is None:
+        return jsonify(error='No origin, asn or regex given'), 400
+
+    query, index, found, results = search_result
+
+    # format=ndjson streams every prefix, one json document per line
+    if request.args.get('format') == 'ndjson':
+        lines = (json.dumps(index_json(prefix, paths)) + '\n' for prefix, paths in results)
+        return Response(lines, mimetype='application/x-ndjson')
+
+    prefixes, next_after = index_page(results)
+    return jsonify(dict(query,
+                        updated=index.updated,
+                        found=found,
+                        prefixes=[index_json(prefix, paths) for prefix, paths in prefixes],
+                        next_after=next_after))
+
+
+DIFF_SIDES = ['rs1', 'rs2', 'rs1-filtered', 'rs2-filtered']
+
+
+def diff_search(service, ip_version):
+    # compares two route sets: of a destination, of a peer or of the whole service table
+    left = request.args.get('left', 'rs1')
+    right = request.args.get('right', 'rs2')
+    if left not in DIFF_SIDES or right not in DIFF_SIDES:
+        raise ValueError('Wrong route set given, use one of: %s' % ', '.join(DIFF_SIDES))
+
+    attributes = request.args.getlist('match')
+    servers = {'rs1': rs1, 'rs2': rs2}
+
+    def side_server(side):
+        return servers[side.split('-')[0]]
+
+    destination = request.args.get('destination', '').strip()
+    peer_id = request.args.get('peer_id', '').strip()
+
+    if destination:
+        if left.endswith('-filtered') or right.endswith('-filtered'):
+            raise ValueError('Filtered routes can be compared for a peer only')
+        # both servers know the same single prefix, only its paths can differ
+        attributes = attributes or list(ATTRIBUTES)
+        destination, ip_version = adopt_prefix(destination)
+        parallel = GetParallel(rs1_func=side_server(left).route,
+                               rs2_func=side_server(right).route,
+                               func_kwargs={'destination': destination,
+                                            'service': service,
+                                            'ip_version': ip_version})
+        left_set, right_set = [RouteSet.from_paths(route.paths if route else [], attributes)
+                               for route in parallel.results]
+
+    elif peer_id:
+        if not peer_id_is_valid(peer_id):
+            raise ValueError('Invalid peer format')
+        index = route_indexes.find(service, ip_version)
+
+        def side_set(side):
+            # accepted paths of an indexed peer are taken from the index, as of its last refresh;
+            # anything else is read from BIRD path by path, only the compared attributes are kept
+            records = None
+            if index is not None and not side.endswith('-filtered'):
+                records = index.peer_records(side, peer_id)
+            if records is not None:
+                return RouteSet(records, attributes)
+            paths = side_server(side).protocol_paths(peer_id, side.endswith('-filtered'),
+                                                     service=service, ip_version=ip_version)
+            return RouteSet.from_paths(paths, attributes)
+
+        parallel = GetParallel(rs1_func=partial(side_set, left), rs2_func=partial(side_set, right))
+        left_set, right_set = parallel.results
+
+    else:
+        if left.endswith('-filtered') or right.endswith('-filtered'):
+            raise ValueError('Filtered routes can be compared for a peer only')
+        index = route_indexes.get(service, ip_version)
+        # until both route servers are pulled, the paths of one would all show up as missing on the other
+        if not (left in index.built and right in index.built):
+            return None
+        left_set = RouteSet(index.records(left), attributes)
+        right_set = RouteSet(index.records(right), attributes)
+
+    return {
+        'left_name': left,
+        'right_name': right,
+        'peer_id': peer_id,
+        'destination': destination,
+        'diff': RouteDiff(left_set, right_set),
+    }
+
+
+@app.route('/<service>/diff/')
+def diff(service):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    if service not in ['fv', 'wix']:
+        return render_template('error.html', error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        result = diff_search(service, ip_version)
+    except ValueError as e:
+        return render_template('error.html', error=e, service=service)
+
+    if result:
+        result['diff'] = result['diff'].as_dict(limit=getattr(config, 'INDEX_PAGE_SIZE', 1000))
+
+    return render_template('page__diff.html',
                            service=service,
                            family=ip_version,
+                           result=result,
+                           args=request.args,
+                           attributes=ATTRIBUTES,
+                           sides=DIFF_SIDES,
                            page='summary',
                            welcome_text=config.WELCOME_TEXT)
 
 
+@app.route('/<service>/diff/json/')
+def diff_json(service):
+    if config.MAINTENANCE:
+        return jsonify(error=config.MAINTENANCE_TEXT), 503
+
+    if service not in ['fv', 'wix']:
+        return jsonify(error='Wrong service'), 404
+
+    ip_version = get_family(request)
+
+    try:
+        result = diff_search(service, ip_version)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if result is None:
+        return jsonify(error='The route table is being indexed'), 503
+
+    result['diff'] = result['diff'].as_dict(limit=getattr(config, 'INDEX_PAGE_SIZE', 1000))
+    return jsonify(result)
+
+
 @app.route('/<service>/peer/<peer_id>/')
 def peer(service, peer_id):
     if config.MAINTENANCE:
@@ -173,50 +559,63 @@ def peer(service, peer_id):
                            rs2=rs2,
                            rs1_peer=rs1_peer,
                            rs2_peer=rs2_peer,
+                           rs1_history=peer_sparklines('rs1', service, ip_version, peer_id),
+                           rs2_history=peer_sparklines('rs2', service, ip_version, peer_id),
                            peer=peer,
                            welcome_text=config.WELCOME_TEXT)
 
 
-@app.route('/<service>/peer/<peer_id>/routes/')
-def peer_prefixes(service, peer_id):
-    if config.MAINTENANCE:
-        return maintenance()
+HISTORY_LABELS = ['12 hours', '7 days', '30 days']
 
-    if service not in ['wix', 'fv']:
-        return render_template('error.html', error='Page not found'), 404
 
-    if not peer_id_is_valid(peer_id):
-        return render_template('error.html', error='Invalid peer format'), 404
+def peer_sparklines(rs, service, ip_version, peer_id):
+    # imported routes of a peer over each history tier, the ones with any sample
+    sparklines = []
+    for tier, label in enumerate(HISTORY_LABELS):
+        line = sparkline(route_history.get(rs, service, ip_version, peer_id, tier))
+        if line:
+            sparklines.append(dict(line, label=label))
+    return sparklines
+
 
-    rejected_mode = request.args.get('rejected', False)
-    if rejected_mode:
-        rejected_mode = True
+@app.route('/<service>/peer/<peer_id>/history/json/')
+def peer_history(service, peer_id):
+    if service not in ['fv', 'wix']:
+        return jsonify(error='Wrong service'), 404
+
+    if not peer_id_is_valid(peer_id):
+        return jsonify(error='Invalid peer format'), 404
 
     ip_version = get_family(request)
 
+    return jsonify(service=service,
+                   ip_version=ip_version,
+                   rs1=route_history.as_dict('rs1', service, ip_version, peer_id),
+                   rs2=route_history.as_dict('rs2', service, ip_version, peer_id))
+
+
+@app.route('/route/history/json/')
+def route_history_stats():
+    return jsonify(route_history.stats())
+
+
+@app.route('/<service>/peer/<peer_id>/routes/')
+def peer_prefixes(service, peer_id):
+    if config.MAINTENANCE:
+        return maintenance()
+
+    try:
+        rejected_mode, ip_version = peer_routes_query(service, peer_id, request)
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
+
     parallel = GetParallel(rs1_func=rs1.peer_routes,
                            rs2_func=rs2.peer_routes,
                            func_args=[peer_id, rejected_mode],
                            func_kwargs={'service': service, 'ip_version': ip_version})
 
-    rs1_result, rs2_result = parallel.results[0], parallel.results[1]
-
-    rs1_peer, rs1_routes = rs1_result
-    rs2_peer, rs2_routes = rs2_result
-
-    return render_template('page__peer_routes.html',
-                           service=service,
-                           family=ip_version,
-                           peer_id=peer_id,
-                           rs1=rs1,
-                           rs2=rs2,
-                           rs1_peer=rs1_peer,
-                           rs2_peer=rs2_peer,
-                           rs1_routes=rs1_routes,
-                           rs2_routes=rs2_routes,
-                           rejected_mode=rejected_mode,
-                           peer=peer,
-                           welcome_text=config.WELCOME_TEXT)
+    return render_page('page__peer_routes.html',
+                       **peer_routes_page(service, ip_version, peer_id, rejected_mode, rs1, rs2, *parallel.results))
 
 
 @app.route('/<service>/route/')
@@ -224,36 +623,118 @@ def route(service):
     if config.MAINTENANCE:
         return maintenance()
 
-    if service not in ['wix', 'fv']:
-        return render_template('error.html', error='Wrong service'), 404
-
-    given_prefix = request.args.get('destination', None)
-    if not given_prefix:
-        return render_template('error.html', error='No prefix given')
-
     try:
-        destination, ip_version = adopt_prefix(given_prefix)
-    except ValueError as e:
-        return render_template('error.html', error=e)
+        given_prefix, destination, ip_version = route_query(service, request)
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
 
-    parallel = GetParallel(rs1_func=rs1.route,
-                           rs2_func=rs2.route,
+    parallel = GetParallel(rs1_func=partial(route_cache.route, 'rs1'),
+                           rs2_func=partial(route_cache.route, 'rs2'),
                            func_kwargs={'destination': destination,
                                         'service': service,
                                         'ip_version': ip_version})
-    rs1_route, rs2_route = parallel.results[0], parallel.results[1]
 
     return render_template('page__route.html',
-                           service=service,
-                           family=ip_version,
-                           destination=given_prefix,
-                           search_string=given_prefix,
-                           rs1=rs1,
-                           rs2=rs2,
-                           rs1_route=rs1_route,
-                           rs2_route=rs2_route,
-                           page='route',
-                           welcome_text=config.WELCOME_TEXT)
+                           **route_page(service, ip_version, given_prefix, rs1, rs2, *parallel.results))
+
+
+@app.route('/route/cache/json/')
+def route_cache_stats():
+    return jsonify(route_cache.stats())
+
+
+@app.route('/admission/json/')
+def admission_stats():
+    return jsonify(clients=limiter.stats(), rs1=rs1.budget.stats(), rs2=rs2.budget.stats(), exports=exports.stats())
+
+
+EXPORT_TYPES = {'ndjson': 'application/x-ndjson', 'mrt': 'application/octet-stream'}
+
+
+@app.route('/<service>/export/')
+def export_table(service):
+    # the whole table of one route server, streamed; offset/limit count prefixes
+    if config.MAINTENANCE:
+        return jsonify(error=config.MAINTENANCE_TEXT), 503
+
+    if service not in ['fv', 'wix']:
+        return jsonify(error='Wrong service'), 404
+
+    ip_version = get_family(request)
+    servers = {'rs1': rs1, 'rs2': rs2}
+
+    rs = request.args.get('rs', 'rs1')
+    if rs not in servers:
+        return jsonify(error='Wrong route server given, use one of: rs1, rs2'), 400
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify(error='Wrong export format given, use one of: %s' % ', '.join(EXPORT_FORMATS)), 400
+
+    given_offset = request.args.get('offset', '0')
+    given_limit = request.args.get('limit', '')
+    if not given_offset.isdigit() or not (given_limit.isdigit() or given_limit == ''):
+        return jsonify(error='Offset and limit are numbers of prefixes'), 400
+    offset = int(given_offset)
+    limit = int(given_limit) if given_limit else None
+
+    compress = bool(request.args.get('gzip', False))
+    stats = ExportStats()
+
+    # the table is read up to the first chunk here, so too many exports are still answered with 429
+    chunks = export(servers[rs], rs, service, ip_version, export_format, compress, offset, limit, stats, exports)
+    first_chunk = next(chunks, b'')
+
+    def generate():
+        yield first_chunk
+        yield from chunks
+        app.logger.info('%s %s ipv%s %s export from prefix %s: %s', rs, service, ip_version, export_format,
+                        offset, stats)
+
+    filename = '%s-%s-ipv%s-%s.%s%s' % (rs, service, ip_version, offset, export_format, '.gz' if compress else '')
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/gzip' if compress else EXPORT_TYPES[export_format])
+    response.headers['Content-Disposition'] = 'attachment; filename=%s' % filename
+    response.headers['X-Export-Offset'] = str(offset)
+    if limit is not None:
+        # a chunk without any path is past the end of the table
+        response.headers['X-Export-Next-Offset'] = str(offset + limit)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.cli.command('export')
+@click.argument('service', type=click.Choice(['fv', 'wix']))
+@click.option('--rs', 'servers', multiple=True, type=click.Choice(['rs1', 'rs2']), help='Default: both')
+@click.option('--family', type=click.Choice(['4', '6']), default='4')
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='ndjson')
+@click.option('--gzip', 'compress', is_flag=True)
+@click.option('--offset', type=int, default=0, help='Prefixes to skip')
+@click.option('--limit', type=int, default=None, help='Prefixes to export')
+@click.option('-o', '--output', default='{rs}-{service}-ipv{family}.{format}',
+              help="File name, {rs} {service} {family} {format} are filled in; '-' for stdout")
+def export_command(service, servers, family, export_format, compress, offset, limit, output):
+    """Export the full table of the route servers."""
+    route_servers = {'rs1': rs1, 'rs2': rs2}
+
+    for rs in servers or ['rs1', 'rs2']:
+        stats = ExportStats()
+        chunks = export(route_servers[rs], rs, service, int(family), export_format, compress, offset, limit, stats)
+
+        if output == '-':
+            stream = click.get_binary_stream('stdout')
+        else:
+            file_name = output.format(rs=rs, service=service, family=family, format=export_format)
+            stream = open(file_name + ('.gz' if compress else ''), 'wb')
+
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+        finally:
+            if output != '-':
+                stream.close()
+
+        click.echo('%s: %s' % (rs, stats), err=True)
 
 
 @app.route('/search/')
@@ -261,21 +742,26 @@ def search():
     if config.MAINTENANCE:
         return maintenance()
 
-    service = request.args.get('service', 'wix')
+    try:
+        return redirect(search_location(request))
+    except PageError as e:
+        return render_template('error.html', **e.context), e.status
 
-    if service not in ['fv', 'wix']:
-        return render_template('error.html', error='Wrong service')
 
-    search_string = request.args.get('search', '').strip()
-    if not search_string:
-        return render_template('error.html', error='Nothing to search', service=service)
+def fetch_summary(service, ip_version):
+    # one 'show protocols all' on each route server, shared by the summary page and its stream
+    parallel = GetParallel(rs1_func=rs1.peers,
+                           rs2_func=rs2.peers,
+                           func_kwargs={'service': service, 'ip_version': ip_version})
 
-    try:
-        destination, ip_version = adopt_prefix(search_string)
-    except ValueError as e:
-        return render_template('error.html', error=e, service=service, search_string=search_string)
+    for rs, peers in (('rs1', parallel.results[0]), ('rs2', parallel.results[1])):
+        route_history.update(rs, service, ip_version, peers)
+        events = journal.update(rs, service, ip_version, peers)
+        if events:
+            # cached routes learnt from a peer that changed are stale
+            route_cache.invalidate(rs, service, ip_version, [event.peer_id for event in events])
 
-    return redirect('/%s/route/?destination=%s&family=%s' % (service, destination, ip_version))
+    return peers_pairs(parallel.results[0], parallel.results[1])
 
 
 def peers_pairs(rs1_peers, rs2_peers):
@@ -284,10 +770,11 @@ def peers_pairs(rs1_peers, rs2_peers):
 
     pairs = []
 
-    checked_values = []
+    checked_values = set()
+    rs2_by_address = {peer.neighbor_address: peer for peer in reversed(rs2_peers)}
 
     for rs1_peer in rs1_peers:
-        pair = find_pair(rs1_peer.neighbor_address, rs2_peers)
+        pair = rs2_by_address.get(rs1_peer.neighbor_address)
         twins = {
             'value': rs1_peer.value,
             'neighbor_address': rs1_peer.neighbor_address,
@@ -298,58 +785,27 @@ def peers_pairs(rs1_peers, rs2_peers):
             'peer_id': rs1_peer.peer_id,
         }
         pairs.append(twins)
-        checked_values.append(rs1_peer.value)
+        checked_values.add(rs1_peer.value)
 
     for rs2_peer in rs2_peers:
         if not rs2_peer.value in checked_values:
-            pair = find_pair(rs2_peer.value, rs1_peers)
             twins = {
                 'value': rs2_peer.value,
                 'neighbor_address': rs2_peer.neighbor_address,
                 'neighbor_as': rs2_peer.neighbor_as,
                 'description': rs2_peer.description,
                 'rs1': rs2_peer,
-                'rs2': pair,
+                'rs2': None,
             }
             pairs.append(twins)
 
     return pairs
 
 
-def find_pair(neighbor_address, peers):
-    for peer in peers:
-        if peer.neighbor_address == neighbor_address:
-            return peer
-    return None
-
-
-def get_family(r):
-    family = r.args.get('family', '4')
-    if family not in ['4', '6']:
-        family = '4'
-    return int(family)
-
-
-def adopt_prefix(destination):
-    try:
-        network = ipaddress.ip_network(destination)
-    except ValueError as e:
-        raise ValueError('Wrong data given: %s' % e)
-
-    # network.network_address — no mask lenght
-    # str(network) — with mask lengh
-
-    if network.version == 4:
-        if network.prefixlen == 32:
-            return '%s' % network.network_address, 4
-        else:
-            return '%s' % network, 4
-
-    if network.version == 6:
-        if network.prefixlen == 128:
-            return '%s' % network.network_address, 6
-        else:
-            return '%s' % network, 6
+feed = SummaryFeed(fetch=fetch_summary,
+                   interval=getattr(config, 'LIVE_INTERVAL', 30),
+                   hidden_asns=config.HIDDEN_PEER_AS or [],
+                   max_watchers=getattr(config, 'LIVE_MAX_WATCHERS', 100))
 
 
 if __name__ == '__main__':
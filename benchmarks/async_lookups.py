@@ -0,0 +1,169 @@
+# Copyright 2019 Vladislav Pavkin
+#
+# Throughput of the route lookup page on the threaded app (app.py, as run
+# by gunicorn gthread) and on the asyncio one (aio_app.py), against a local
+# fake BIRD: an SSH server that answers every command after a delay.
+#
+#   python benchmarks/async_lookups.py [requests] [delay seconds] [threads]
+#
+# Needs config.py, as the app itself does.
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+import paramiko
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AsyncCommandBudget, ClientLimiter, CommandBudget  # noqa: E402
+from aio import AsyncRouteServer  # noqa: E402
+from models import RouteServer  # noqa: E402
+
+ROUTE_DUMP = '\n'.join([
+    'BIRD 2.0.7 ready.',
+    'Table master4:',
+    '1.2.3.0/24           unicast [peer4_1000 2019-11-01 10:00:00 from 10.0.0.1] * (100) [AS64512i]',
+    '\tvia 10.0.0.1 on eth0',
+    '\tType: BGP univ',
+    '\tBGP.origin: IGP',
+    '\tBGP.as_path: 1000 3356 64512',
+    '\tBGP.next_hop: 10.0.0.1',
+    '\tBGP.local_pref: 100',
+    '\tBGP.community: (1234,4000)',
+]) + '\n'
+
+
+class FakeBird(paramiko.ServerInterface):
+    # accepts anybody and answers every exec with ROUTE_DUMP after `delay` seconds
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._answer, args=[channel], daemon=True).start()
+        return True
+
+    def _answer(self, channel):
+        sleep(self.delay)
+        channel.sendall(ROUTE_DUMP.encode())
+        channel.send_exit_status(0)
+        channel.close()
+
+
+def serve(delay):
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def accept():
+        while True:
+            client, address = listener.accept()
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key)
+            transport.start_server(server=FakeBird(delay))
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def local(route_server_class, port):
+    # the route server class, connecting to the fake BIRD with an unlimited budget
+
+    class LocalRouteServer(route_server_class):
+        def connect(self):
+            session = paramiko.SSHClient()
+            session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            session.connect('127.0.0.1', port=port, username='lg', password='lg',
+                            allow_agent=False, look_for_keys=False)
+            self._session = session
+
+    budget_class = AsyncCommandBudget if asyncio.iscoroutinefunction(route_server_class.route) else CommandBudget
+    return lambda name: LocalRouteServer(server=name, budget=budget_class(name, concurrency=10000, queue=0))
+
+
+def addresses(count):
+    # a new address every request, so the route cache does not answer them
+    return ['1.2.%d.%d' % (number >> 8 & 255, number & 255) for number in range(count)]
+
+
+def threaded(port, count, threads):
+    import app
+
+    route_server = local(RouteServer, port)
+    app.rs1 = app.route_cache.route_servers['rs1'] = route_server('rs1')
+    app.rs2 = app.route_cache.route_servers['rs2'] = route_server('rs2')
+    app.limiter = ClientLimiter(rate=10 ** 9, burst=10 ** 9)
+    client = app.app.test_client()
+
+    def lookup(address):
+        return client.get('/fv/route/?destination=%s' % address).status_code
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(lookup, addresses(count)))
+    return perf_counter() - started, statuses
+
+
+def asynchronous(port, count):
+    import aio_app
+
+    route_server = local(AsyncRouteServer, port)
+    aio_app.rs1 = aio_app.route_cache.route_servers['rs1'] = route_server('rs1')
+    aio_app.rs2 = aio_app.route_cache.route_servers['rs2'] = route_server('rs2')
+    aio_app.limiter = ClientLimiter(rate=10 ** 9, burst=10 ** 9)
+
+    async def lookup(address):
+        scope = {'type': 'http', 'path': '/fv/route/', 'query_string': ('destination=%s' % address).encode(),
+                 'headers': [], 'client': ('127.0.0.1', 0)}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        await aio_app.app(scope, receive, send)
+        return sent[0]['status']
+
+    async def run():
+        return await asyncio.gather(*[lookup(address) for address in addresses(count)])
+
+    started = perf_counter()
+    statuses = asyncio.run(run())
+    return perf_counter() - started, statuses
+
+
+def report(title, count, elapsed, statuses):
+    failed = sum(1 for status in statuses if status != 200)
+    print('%-30s %8.2f s %10.1f requests/s %6d failed' % (title, elapsed, count / elapsed, failed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    port = serve(delay)
+    print('%s lookups, BIRD answers in %s s' % (count, delay))
+    report('threaded, %s threads' % threads, count, *threaded(port, count, threads))
+    report('asyncio, 1 thread', count, *asynchronous(port, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Copyright 2019 Vladislav Pavkin
+#
+# Full-table scale benchmark of the route index: parses a synthetic
+# 'show route table master4 all' dump with BGPPrefix, indexes it and
+# times community, origin, any-AS and regex lookups.
+#
+#   python benchmarks/route_index.py [paths]
+#
+# Needs config.py, as the app itself does.
+
+import os
+import random
+import resource
+import sys
+from itertools import islice
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import RouteServer, BGPPrefix  # noqa: E402
+from route_index import PeerPaths, PeerRoutes, RouteIndex, community_key  # noqa: E402
+
+PEERS = 200
+PATHS_PER_PREFIX = 2
+
+
+def table_dump(paths):
+    # BIRD 2 style output, the first path of a prefix carries the prefix itself
+    rnd = random.Random(1)
+    yield 'BIRD 2.0.7 ready.'
+    yield 'Table master4:'
+    for number in range(paths // PATHS_PER_PREFIX):
+        prefix = '%d.%d.%d.0/24' % (1 + (number >> 16), (number >> 8) & 255, number & 255)
+        origin = 64512 + number % 5000
+        for path in range(PATHS_PER_PREFIX):
+            peer = rnd.randrange(PEERS) + 1000
+            transit = rnd.choice([174, 3356, 1299, 6939])
+            head = prefix.ljust(20) if path == 0 else ' ' * 20
+            yield '%s unicast [peer4_%s 2019-11-01 10:00:00 from 10.0.0.1] %s(100) [AS%si]' % (
+                head, peer, '* ' if path == 0 else '', origin)
+            yield '\tvia 10.0.0.1 on eth0'
+            yield '\tType: BGP univ'
+            yield '\tBGP.origin: IGP'
+            yield '\tBGP.as_path: %s %s %s' % (peer, transit, origin)
+            yield '\tBGP.next_hop: 10.0.0.1'
+            yield '\tBGP.local_pref: 100'
+            communities = ['(1234,%s)' % (4000 + number % 3)]
+            if number % 1000 == 0:
+                communities.append('(1234,9999)')
+            yield '\tBGP.community: %s' % ' '.join(communities)
+
+
+def timed(title, func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        result = func()
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-40s %10.2f ms' % (title, best * 1000))
+    return result
+
+
+def main():
+    paths = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    started = perf_counter()
+    paths_by_peer = {}
+    for destination, path_dump in RouteServer._parse__show_route_table(table_dump(paths)):
+        path = BGPPrefix(dump=path_dump, ip_version=4, destination=destination)
+        paths_by_peer.setdefault(path.peer_id, PeerPaths()).add(path)
+    elapsed = perf_counter() - started
+    print('%-40s %10.2f s (%d paths/s)' % ('parse %d paths with BGPPrefix' % paths, elapsed, paths / elapsed))
+    print('%-40s %10d MiB' % ('max RSS after the pull', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10))
+
+    index = RouteIndex('fv', 4)
+    started = perf_counter()
+    for peer_id, peer_paths in paths_by_peer.items():
+        index.replace_peer(PeerRoutes('rs1', peer_id, None, peer_paths))
+    print('%-40s %10.2f s' % ('index %d paths' % len(index), perf_counter() - started))
+    del paths_by_peer
+
+    def first_page(search):
+        found, results = search()
+        return found, list(islice(results, 1000))
+
+    timed('community 1234,9999, first 1000', lambda: first_page(
+        lambda: index.search('community', community_key(1234, 9999))))
+    timed('community 1234,4000, first 1000', lambda: first_page(
+        lambda: index.search('community', community_key(1234, 4000))))
+    timed('origin AS64512, first 1000', lambda: first_page(lambda: index.search('origin', 64512)))
+    timed('any AS3356, first 1000', lambda: first_page(lambda: index.search('asn', 3356)))
+    timed('regex ^1000_.*_64512$ (narrowed)', lambda: first_page(lambda: index.search_regex('^1000_.*_64512$')))
+    timed('regex ^100[0-9] 174 (full scan)', lambda: first_page(lambda: index.search_regex('^100[0-9] 174')), 1)
+    timed('stream every AS3356 prefix', lambda: sum(1 for _ in index.search('asn', 3356)[1]), 1)
+
+
+if __name__ == '__main__':
+    main()
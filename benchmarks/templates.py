@@ -0,0 +1,120 @@
+# Copyright 2019 Vladislav Pavkin
+#
+# Render time of the summary and peer routes pages for large tables:
+# builds synthetic peers and paths with the real parsers, then times a
+# full render, a streamed render and template loading with and without
+# the bytecode cache.
+#
+#   python benchmarks/templates.py [rows ...]
+#
+# Needs config.py, as the app itself does.
+
+import os
+import sys
+import tempfile
+from time import perf_counter, time
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import BGPPrefix, Peer, Summary  # noqa: E402
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+def peer(number, rs):
+    dump = [
+        'peer4_%s BGP master up 2019-11-01 10:00:00 Established' % number,
+        '  Description:    Peer %s @ %s' % (number, rs),
+        '    Routes:         %s imported, %s filtered, 10 exported, 5 preferred' % (number % 300, number % 7),
+        '  BGP state:          Established',
+        '    Neighbor address: 10.%s.%s.%s' % (number >> 16 & 255, number >> 8 & 255, number & 255),
+        '    Neighbor AS:      %s' % (64512 + number),
+    ]
+    return Peer(dump=dump, ip_version=4)
+
+
+def path(number):
+    prefix = '%d.%d.%d.0/24' % (1 + (number >> 16), (number >> 8) & 255, number & 255)
+    dump = '\n'.join([
+        ' unicast [peer4_1000 2019-11-01 10:00:00 from 10.0.0.1] * (100) [AS%si]' % (64512 + number % 5000),
+        '\tvia 10.0.0.1 on eth0',
+        '\tType: BGP univ',
+        '\tBGP.origin: IGP',
+        '\tBGP.as_path: 1000 3356 %s' % (64512 + number % 5000),
+        '\tBGP.next_hop: 10.0.0.1',
+        '\tBGP.local_pref: 100',
+        '\tBGP.community: (1234,%s) (65501,%s)' % (4000 + number % 3, number % 100),
+    ])
+    return BGPPrefix(dump=dump, ip_version=4, destination=prefix)
+
+
+def summary_context(rows):
+    pairs = []
+    for number in range(rows):
+        rs1_peer, rs2_peer = peer(number, 'rs1'), peer(number, 'rs2')
+        pairs.append({
+            'value': rs1_peer.value,
+            'neighbor_address': rs1_peer.neighbor_address,
+            'neighbor_as': rs1_peer.neighbor_as,
+            'description': rs1_peer.description,
+            'rs1': rs1_peer,
+            'rs2': rs2_peer,
+            'peer_id': rs1_peer.peer_id,
+        })
+    now = time()
+    return {'pairs': Summary(pairs).rows(now), 'now': now, 'service': 'fv', 'family': 4, 'stream_seq': 0,
+            'page': 'summary'}
+
+
+def peer_routes_context(rows):
+    rs_peer = peer(1000, 'rs1')
+    rs_peer.imported_routes = 0  # the page shows routes of peers with few of them only
+    routes = [path(number) for number in range(rows)]
+    return {'rs1_peer': rs_peer, 'rs2_peer': rs_peer, 'rs1_routes': routes, 'rs2_routes': routes,
+            'rejected_mode': False, 'service': 'fv', 'family': 4, 'peer_id': 'peer_1000', 'page': 'summary'}
+
+
+def timed(title, func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        func()
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-50s %10.2f ms' % (title, best * 1000))
+
+
+def first_chunk(template, context):
+    return next(iter(template.generate(context)))
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 100000]
+    names = ['page__summary.html', 'page__peer_routes.html']
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # a fresh environment compiles the templates, the next one loads bytecode
+        timed('load templates, compiled', lambda: [
+            Environment(loader=FileSystemLoader(TEMPLATES)).get_template(name) for name in names], 1)
+        Environment(loader=FileSystemLoader(TEMPLATES),
+                    bytecode_cache=FileSystemBytecodeCache(cache_dir)).get_template(names[1])
+        timed('load templates, bytecode cache', lambda: [
+            Environment(loader=FileSystemLoader(TEMPLATES),
+                        bytecode_cache=FileSystemBytecodeCache(cache_dir)).get_template(name) for name in names], 1)
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES), auto_reload=False)
+
+    for rows in sizes:
+        for name, make_context in (('page__summary.html', summary_context),
+                                   ('page__peer_routes.html', peer_routes_context)):
+            context = make_context(rows)
+            template = env.get_template(name)
+            repeat = 1 if rows >= 100000 else 3
+            timed('%s, %s rows, render' % (name, rows), lambda: template.render(context), repeat)
+            timed('%s, %s rows, first streamed chunk' % (name, rows), lambda: first_chunk(template, context), repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -40,3 +40,64 @@ PREPEND_COMMUNITIES = {
 }
 
 SENTRY_KEY = ''
+
+# Peer state changes kept in memory, oldest are dropped first
+JOURNAL_SIZE = 10000
+
+# Series of route counts kept over 30 days, one per peer, route server and family:
+# 10000 peers on both route servers in both families are 40000. About 4 KiB each,
+# taken by the peers there are only (150 MiB for 40000); the ones seen least
+# recently are dropped first, so keep it above what the summaries list or the
+# history is lost on every refresh
+ROUTE_HISTORY_SIZE = 40000
+
+# Seconds between summary fetches while somebody watches the live summary
+LIVE_INTERVAL = 30
+
+# Live summaries open at once; each holds a server thread while open, keep it
+# well below the gunicorn --threads count (see templates/conf/supervisord.conf)
+LIVE_MAX_WATCHERS = 100
+
+# Seconds between refreshes of the community index, and prefixes shown per search
+INDEX_INTERVAL = 600
+INDEX_PAGE_SIZE = 1000
+
+# Every Nth index refresh pulls the whole table again; the others re-pull only
+# peers whose state, last event time or route counts changed, so a community
+# changed on an otherwise stable peer is found after up to N * INDEX_INTERVAL
+INDEX_FULL_EVERY = 24
+
+# Seconds an AS-path regex search may take over the index before it is answered
+# with an error asking for an ASN to narrow it down
+ASPATH_SEARCH_TIMEOUT = 10
+
+# Parsed route lookups kept in memory, and for how long in seconds
+ROUTE_CACHE_SIZE = 10000
+ROUTE_CACHE_TTL = 60
+
+# Where compiled templates are kept (a temporary directory if None), and whether
+# the summary and peer routes pages are sent while they render
+TEMPLATE_CACHE_DIR = None
+STREAM_TEMPLATES = False
+
+# Requests per second each client may send, and how many at once after a pause;
+# counted by each process, so a client gets as much again from aio_app.py
+RATE_LIMIT = 2
+RATE_BURST = 20
+
+# Proxies whose X-Forwarded-For tells the client address
+TRUSTED_PROXIES = ['127.0.0.1', '::1']
+
+# BIRD commands run at once on each route server, how many more may wait for
+# a slot and for how many seconds, before requests are answered with 429.
+# Each process keeps its own: aio_app.py runs up to ASYNC_BIRD_CONCURRENCY
+# next to the BIRD_CONCURRENCY of app.py, so a route server gets the sum of
+# both; lower BIRD_CONCURRENCY by as much when aio_app.py runs
+BIRD_CONCURRENCY = 8
+ASYNC_BIRD_CONCURRENCY = 4
+BIRD_QUEUE = 32
+BIRD_QUEUE_TIMEOUT = 2
+
+# Table exports running at once, beside the BIRD commands above; a download
+# holds its slot until it is done, more are answered with 429
+EXPORT_CONCURRENCY = 2
@@ -0,0 +1,247 @@
+# Copyright 2019 Vladislav Pavkin
+#
+# Full table exports: every path of a service/family table on a route server,
+# as NDJSON (one path per line) or MRT TABLE_DUMP_V2 (RFC 6396, one RIB
+# record per prefix), optionally gzipped. The table is encoded as BIRD dumps
+# it, nothing but the paths of one prefix is held at a time.
+#
+# Exports resume by prefix: `offset` skips the first prefixes of the table,
+# `limit` stops after as many; chunks of one table may be concatenated, the
+# MRT sequence numbers go on from the offset, gzip members add up to one file.
+
+import json
+import struct
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby, islice
+from operator import attrgetter
+from socket import AF_INET, AF_INET6, inet_pton
+from time import perf_counter, time
+
+EXPORT_FORMATS = ('ndjson', 'mrt')
+
+CHUNK_SIZE = 65536
+
+MRT_TABLE_DUMP_V2 = 13
+MRT_PEER_INDEX_TABLE = 1
+MRT_RIB_UNICAST = {4: 2, 6: 4}  # RIB_IPV4_UNICAST, RIB_IPV6_UNICAST
+
+ATTR_ORIGIN = 1
+ATTR_AS_PATH = 2
+ATTR_NEXT_HOP = 3
+ATTR_LOCAL_PREF = 5
+ATTR_COMMUNITIES = 8
+ATTR_MP_REACH_NLRI = 14
+
+FLAG_OPTIONAL = 0x80
+FLAG_TRANSITIVE = 0x40
+FLAG_EXTENDED_LENGTH = 0x10
+
+AS_SEQUENCE = 2
+ORIGINS = {'IGP': 0, 'EGP': 1, 'Incomplete': 2}
+
+
+class ExportStats:
+    # what an export has sent so far
+
+    def __init__(self):
+        self.rows = 0  # paths
+        self.prefixes = 0
+        self.skipped = 0  # paths of peers unknown to the MRT peer index
+        self.started = perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'prefixes': self.prefixes,
+            'skipped': self.skipped,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rate, 1),
+        }
+
+    def __str__(self):
+        return '%s paths of %s prefixes in %.1f s, %.0f paths/s%s' % (
+            self.rows, self.prefixes, self.elapsed, self.rate,
+            ', %s skipped' % self.skipped if self.skipped else '')
+
+
+def as_int(value):
+    return int(value) if value and value.isdigit() else None
+
+
+def path_record(rs, path) -> dict:
+    return {
+        'rs': rs,
+        'prefix': path.destination,
+        'peer_id': path.peer_id,
+        'next_hop': path.next_hop,
+        'as_path': [int(asn) for asn in path.as_path],
+        'origin': path.origin,
+        'local_pref': as_int(path.local_pref),
+        'communities': [[community.asn, community.value] for community in path.communities],
+        'preferred': path.preferred,
+        'time': path.time,
+    }
+
+
+def ndjson(rs, groups, stats):
+    for prefix, paths in groups:
+        stats.prefixes += 1
+        for path in paths:
+            stats.rows += 1
+            yield (json.dumps(path_record(rs, path)) + '\n').encode('utf-8')
+
+
+@lru_cache(maxsize=4096)
+def originated(path_time) -> int:
+    # BIRD path times are local, a table holds few distinct ones
+    try:
+        return int(datetime.strptime(path_time, '%Y-%m-%d %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def mrt_record(subtype, body, timestamp) -> bytes:
+    return struct.pack('!IHHI', timestamp, MRT_TABLE_DUMP_V2, subtype, len(body)) + body
+
+
+def peer_index_table(rs, peers) -> bytes:
+    # the route servers do not tell peer router IDs, they are all 0.0.0.0
+    view = rs.encode('utf-8')
+    body = [struct.pack('!4sH', bytes(4), len(view)), view, struct.pack('!H', len(peers))]
+    for peer in peers:
+        family = AF_INET6 if ':' in peer.neighbor_address else AF_INET
+        peer_type = 0x02 | (0x01 if family == AF_INET6 else 0)  # 4-byte AS, IPv6 address
+        body.append(struct.pack('!B4s', peer_type, bytes(4)))
+        body.append(inet_pton(family, peer.neighbor_address))
+        body.append(struct.pack('!I', int(peer.neighbor_as)))
+    return b''.join(body)
+
+
+def attribute(flags, attribute_type, value) -> bytes:
+    if len(value) > 255:
+        return struct.pack('!BBH', flags | FLAG_EXTENDED_LENGTH, attribute_type, len(value)) + value
+    return struct.pack('!BBB', flags, attribute_type, len(value)) + value
+
+
+def path_attributes(path, ip_version) -> bytes:
+    attributes = []
+
+    if path.origin in ORIGINS:
+        attributes.append(attribute(FLAG_TRANSITIVE, ATTR_ORIGIN, bytes((ORIGINS[path.origin],))))
+
+    # always 4-byte ASNs in TABLE_DUMP_V2, a segment holds 255 of them at most
+    asns = [int(asn) for asn in path.as_path]
+    segments = b''.join(struct.pack('!BB%sI' % len(chunk), AS_SEQUENCE, len(chunk), *chunk)
+                        for chunk in (asns[i:i + 255] for i in range(0, len(asns), 255)))
+    attributes.append(attribute(FLAG_TRANSITIVE, ATTR_AS_PATH, segments))
+
+    if path.next_hop:
+        if ip_version == 4:
+            attributes.append(attribute(FLAG_TRANSITIVE, ATTR_NEXT_HOP, inet_pton(AF_INET, path.next_hop)))
+        else:
+            # RFC 6396 4.3.4: only the next hop length and address are kept
+            next_hop = inet_pton(AF_INET6, path.next_hop)
+            attributes.append(attribute(FLAG_OPTIONAL, ATTR_MP_REACH_NLRI, bytes((len(next_hop),)) + next_hop))
+
+    local_pref = as_int(path.local_pref)
+    if local_pref is not None:
+        attributes.append(attribute(FLAG_TRANSITIVE, ATTR_LOCAL_PREF, struct.pack('!I', local_pref)))
+
+    # standard communities are two 16-bit halves, anything wider is not one
+    communities = [(community.asn, community.value) for community in path.communities
+                   if community.asn <= 0xFFFF and community.value <= 0xFFFF]
+    if communities:
+        values = b''.join(struct.pack('!HH', asn, value) for asn, value in communities)
+        attributes.append(attribute(FLAG_OPTIONAL | FLAG_TRANSITIVE, ATTR_COMMUNITIES, values))
+
+    return b''.join(attributes)
+
+
+def rib_prefix(prefix, ip_version) -> bytes:
+    address, _, length = prefix.partition('/')
+    length = int(length or (32 if ip_version == 4 else 128))
+    packed = inet_pton(AF_INET if ip_version == 4 else AF_INET6, address)
+    return bytes((length,)) + packed[:(length + 7) // 8]
+
+
+def mrt(rs, peers, groups, ip_version, offset, stats):
+    timestamp = int(time())
+    peers = [peer for peer in peers if peer.peer_id and peer.neighbor_address and peer.neighbor_as]
+    peer_indexes = {peer.peer_id: index for index, peer in enumerate(peers)}
+    subtype = MRT_RIB_UNICAST[ip_version]
+
+    yield mrt_record(MRT_PEER_INDEX_TABLE, peer_index_table(rs, peers), timestamp)
+
+    for sequence, (prefix, paths) in enumerate(groups, offset):
+        stats.prefixes += 1
+        entries = []
+        for path in paths:
+            peer_index = peer_indexes.get(path.peer_id)
+            if peer_index is None:
+                stats.skipped += 1
+                continue
+            attributes = path_attributes(path, ip_version)
+            entries.append(struct.pack('!HIH', peer_index, originated(path.time), len(attributes)) + attributes)
+            stats.rows += 1
+
+        if entries:
+            body = struct.pack('!I', sequence & 0xFFFFFFFF) + rib_prefix(prefix, ip_version) + \
+                   struct.pack('!H', len(entries)) + b''.join(entries)
+            yield mrt_record(subtype, body, timestamp)
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    # fewer, larger writes; a record is never held back for longer than `size` bytes
+    buffer = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(route_server, rs, service, ip_version, export_format='ndjson', compress=False,
+           offset=0, limit=None, stats=None, budget=None):
+    # bytes of the export of the table of a route server, generated as the table is read;
+    # the dump takes a slot of `budget` instead of one of the route server's own
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Wrong export format given, use one of: %s' % ', '.join(EXPORT_FORMATS))
+
+    stats = stats if stats is not None else ExportStats()
+    paths = route_server.table(service=service, ip_version=ip_version, offset=offset, budget=budget)
+    groups = islice(groupby(paths, key=attrgetter('destination')), limit)
+
+    if export_format == 'mrt':
+        peers = route_server.peers(service=service, ip_version=ip_version)
+        chunks = mrt(rs, peers, groups, ip_version, offset, stats)
+    else:
+        chunks = ndjson(rs, groups, stats)
+
+    chunks = buffered(chunks)
+    if compress:
+        chunks = gzipped(chunks)
+    return chunks
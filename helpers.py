@@ -0,0 +1,167 @@
+# Copyright 2019 Vladislav Pavkin
+
+import ipaddress
+import re
+
+import config
+from admission import AsyncCommandBudget, ClientLimiter, CommandBudget
+
+
+def command_budget(name) -> CommandBudget:
+    # BIRD commands run at once on a route server, waiting for a slot and for how long
+    #
+    # the budget is kept by the process, app.py and aio_app.py each have their own
+    return CommandBudget(name,
+                         concurrency=getattr(config, 'BIRD_CONCURRENCY', 8),
+                         queue=getattr(config, 'BIRD_QUEUE', 32),
+                         timeout=getattr(config, 'BIRD_QUEUE_TIMEOUT', 2))
+
+
+def async_command_budget(name) -> AsyncCommandBudget:
+    # same as command_budget(), for aio_app.py; BIRD sees the commands of both processes at once
+    return AsyncCommandBudget(name,
+                              concurrency=getattr(config, 'ASYNC_BIRD_CONCURRENCY', 4),
+                              queue=getattr(config, 'BIRD_QUEUE', 32),
+                              timeout=getattr(config, 'BIRD_QUEUE_TIMEOUT', 2))
+
+
+def export_budget() -> CommandBudget:
+    # exports running at once, on any route server; a download holds its slot until
+    # it is done, so exports never take the slots of the lookups and more are refused
+    return CommandBudget('exports', concurrency=getattr(config, 'EXPORT_CONCURRENCY', 2), queue=0)
+
+
+def client_limiter() -> ClientLimiter:
+    return ClientLimiter(rate=getattr(config, 'RATE_LIMIT', 2), burst=getattr(config, 'RATE_BURST', 20))
+
+
+def peer_id_is_valid(peer_id: str) -> bool:
+    peer_re = re.compile(r'^peer_\d{4,6}$')
+    if peer_re.match(peer_id):
+        return True
+    return False
+
+
+def client_address(remote_address, forwarded=None) -> str:
+    # behind the proxy the client is the last address it added to X-Forwarded-For
+    if forwarded and remote_address in getattr(config, 'TRUSTED_PROXIES', ['127.0.0.1', '::1']):
+        return forwarded.split(',')[-1].strip()
+    return remote_address
+
+
+def get_family(r):
+    family = r.args.get('family', '4')
+    if family not in ['4', '6']:
+        family = '4'
+    return int(family)
+
+
+def adopt_prefix(destination):
+    try:
+        network = ipaddress.ip_network(destination)
+    except ValueError as e:
+        raise ValueError('Wrong data given: %s' % e)
+
+    # network.network_address — no mask lenght
+    # str(network) — with mask lengh
+
+    if network.version == 4:
+        if network.prefixlen == 32:
+            return '%s' % network.network_address, 4
+        else:
+            return '%s' % network, 4
+
+    if network.version == 6:
+        if network.prefixlen == 128:
+            return '%s' % network.network_address, 6
+        else:
+            return '%s' % network, 6
+
+
+# The pages both app.py and aio_app.py serve: what the request asks for and what
+# the template is rendered with are worked out here, each app only asks the route
+# servers its own way in between. A *_query() raises PageError for error.html.
+
+class PageError(Exception):
+    # a request answered with error.html: the error, the rest of its context and the status
+
+    def __init__(self, error, status=200, **context):
+        super().__init__(error)
+        self.status = status
+        self.context = dict(context, error=error)
+
+
+def route_query(service, r) -> (str, str, int):
+    # (given prefix, destination, ip_version) of /<service>/route/
+    if service not in ['wix', 'fv']:
+        raise PageError('Wrong service', 404)
+
+    given_prefix = r.args.get('destination', None)
+    if not given_prefix:
+        raise PageError('No prefix given')
+
+    try:
+        destination, ip_version = adopt_prefix(given_prefix)
+    except ValueError as e:
+        raise PageError(e)
+    return given_prefix, destination, ip_version
+
+
+def route_page(service, ip_version, given_prefix, rs1, rs2, rs1_route, rs2_route) -> dict:
+    return dict(service=service,
+                family=ip_version,
+                destination=given_prefix,
+                search_string=given_prefix,
+                rs1=rs1,
+                rs2=rs2,
+                rs1_route=rs1_route,
+                rs2_route=rs2_route,
+                page='route',
+                welcome_text=config.WELCOME_TEXT)
+
+
+def peer_routes_query(service, peer_id, r) -> (bool, int):
+    # (rejected mode, ip_version) of /<service>/peer/<peer_id>/routes/
+    if service not in ['wix', 'fv']:
+        raise PageError('Page not found', 404)
+
+    if not peer_id_is_valid(peer_id):
+        raise PageError('Invalid peer format', 404)
+
+    return bool(r.args.get('rejected', False)), get_family(r)
+
+
+def peer_routes_page(service, ip_version, peer_id, rejected_mode, rs1, rs2, rs1_result, rs2_result) -> dict:
+    # rs1_result and rs2_result are (peer, routes) as RouteServer.peer_routes() returns them
+    rs1_peer, rs1_routes = rs1_result
+    rs2_peer, rs2_routes = rs2_result
+
+    return dict(service=service,
+                family=ip_version,
+                peer_id=peer_id,
+                rs1=rs1,
+                rs2=rs2,
+                rs1_peer=rs1_peer,
+                rs2_peer=rs2_peer,
+                rs1_routes=rs1_routes,
+                rs2_routes=rs2_routes,
+                rejected_mode=rejected_mode,
+                welcome_text=config.WELCOME_TEXT)
+
+
+def search_location(r) -> str:
+    # where /search/ sends a prefix or an address to
+    service = r.args.get('service', 'wix')
+    if service not in ['fv', 'wix']:
+        raise PageError('Wrong service')
+
+    search_string = r.args.get('search', '').strip()
+    if not search_string:
+        raise PageError('Nothing to search', service=service)
+
+    try:
+        destination, ip_version = adopt_prefix(search_string)
+    except ValueError as e:
+        raise PageError(e, service=service, search_string=search_string)
+
+    return '/%s/route/?destination=%s&family=%s' % (service, destination, ip_version)
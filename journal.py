@@ -0,0 +1,185 @@
+# Copyright 2019 Vladislav Pavkin
+
+from collections import deque
+from threading import Lock
+from time import time
+
+# Peer attributes followed by the journal, in snapshot tuple order
+TRACKED_FIELDS = (
+    'state',
+    'bgp_state',
+    'imported_routes',
+    'filtered_routes',
+    'exported_routes',
+    'preferred_routes',
+    'last_event_time',
+    'neighbor_as',
+)
+
+AS_FIELD = TRACKED_FIELDS.index('neighbor_as')
+
+
+class PeerEvent:
+    # a single change of a peer between two summary fetches
+
+    __slots__ = ('seq', 'time', 'rs', 'service', 'ip_version', 'peer_id', 'neighbor_as', 'kind', 'changes')
+
+    def __init__(self, seq, time, rs, service, ip_version, peer_id, neighbor_as, kind, changes):
+        self.seq = seq
+        self.time = time
+        self.rs = rs
+        self.service = service
+        self.ip_version = ip_version
+        self.peer_id = peer_id
+        self.neighbor_as = neighbor_as
+        self.kind = kind  # 'appeared', 'changed' or 'gone'
+        self.changes = changes  # {field: (old, new)}
+
+    def __str__(self):
+        return '<PeerEvent #%s %s %s %s>' % (self.seq, self.rs, self.peer_id, self.kind)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def is_flap(self):
+        # a session that went down and back up between two fetches is 'up' both times,
+        # only its last event time tells
+        return self.kind == 'changed' and ('state' in self.changes or 'last_event_time' in self.changes)
+
+    def as_dict(self):
+        return {
+            'seq': self.seq,
+            'time': self.time,
+            'rs': self.rs,
+            'service': self.service,
+            'ip_version': self.ip_version,
+            'peer_id': self.peer_id,
+            'neighbor_as': self.neighbor_as,
+            'kind': self.kind,
+            'changes': {field: list(values) for field, values in self.changes.items()},
+        }
+
+
+class PeerJournal:
+    # diffs successive peer snapshots of every route server into a bounded event log
+    #
+    # the log is a ring buffer of `size` events, the snapshots hold one tuple per
+    # known peer, so memory does not grow with uptime
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.seq = 0
+
+        self._events = deque()
+        self._snapshots = {}  # (rs, service, ip_version) -> {peer_id: tuple of TRACKED_FIELDS}
+        self._flaps = {}  # (rs, service, ip_version, peer_id, neighbor_as) -> flaps in the log
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    @staticmethod
+    def _snapshot(peers):
+        return {peer.peer_id: tuple(getattr(peer, field) for field in TRACKED_FIELDS) for peer in peers}
+
+    def update(self, rs, service, ip_version, peers, now=None) -> list:
+        # an empty list means the route server was not reachable, keep the previous snapshot
+        if not peers:
+            return []
+
+        now = now or time()
+        key = (rs, service, ip_version)
+        current = self._snapshot(peers)
+
+        with self._lock:
+            previous = self._snapshots.get(key)
+            self._snapshots[key] = current
+
+            # the first snapshot is a baseline, not a change
+            if previous is None:
+                return []
+
+            events = []
+            for peer_id, values in current.items():
+                old_values = previous.get(peer_id)
+                if old_values == values:
+                    continue
+                if old_values is None:
+                    changes = {field: (None, value) for field, value in zip(TRACKED_FIELDS, values)}
+                    events.append(self._append(now, key, peer_id, values[AS_FIELD], 'appeared', changes))
+                    continue
+                changes = {field: (old, new)
+                           for field, old, new in zip(TRACKED_FIELDS, old_values, values) if old != new}
+                events.append(self._append(now, key, peer_id, values[AS_FIELD], 'changed', changes))
+
+            for peer_id in previous.keys() - current.keys():
+                changes = {field: (value, None) for field, value in zip(TRACKED_FIELDS, previous[peer_id])}
+                events.append(self._append(now, key, peer_id, previous[peer_id][AS_FIELD], 'gone', changes))
+
+            return events
+
+    def _append(self, now, key, peer_id, neighbor_as, kind, changes):
+        if len(self._events) >= self.size:
+            self._forget(self._events.popleft())
+
+        self.seq += 1
+        event = PeerEvent(self.seq, now, *key, peer_id, neighbor_as, kind, changes)
+        self._events.append(event)
+
+        if event.is_flap:
+            flap_key = key + (peer_id, neighbor_as)
+            self._flaps[flap_key] = self._flaps.get(flap_key, 0) + 1
+
+        return event
+
+    def _forget(self, event):
+        if not event.is_flap:
+            return
+        flap_key = (event.rs, event.service, event.ip_version, event.peer_id, event.neighbor_as)
+        count = self._flaps[flap_key] - 1
+        if count:
+            self._flaps[flap_key] = count
+        else:
+            del self._flaps[flap_key]
+
+    def recent(self, service=None, ip_version=None, rs=None, peer_id=None, since_seq=0, limit=100,
+               hidden_asns=()) -> list:
+        # newest first, peers of hidden_asns left out
+        with self._lock:
+            events = list(self._events)
+
+        result = []
+        for event in reversed(events):
+            if event.seq <= since_seq:
+                break
+            if service is not None and event.service != service:
+                continue
+            if ip_version is not None and event.ip_version != ip_version:
+                continue
+            if rs is not None and event.rs != rs:
+                continue
+            if peer_id is not None and event.peer_id != peer_id:
+                continue
+            if event.neighbor_as in hidden_asns:
+                continue
+            result.append(event)
+            if len(result) >= limit:
+                break
+        return result
+
+    def flaps(self, service, ip_version, rs=None, hidden_asns=()) -> dict:
+        # {peer_id: flaps} over the events still in the log, peers of hidden_asns left out
+        with self._lock:
+            flaps = list(self._flaps.items())
+
+        counts = {}
+        for (flap_rs, flap_service, flap_ip_version, peer_id, neighbor_as), count in flaps:
+            if flap_service != service or flap_ip_version != ip_version:
+                continue
+            if neighbor_as in hidden_asns:
+                continue
+            if rs is not None and flap_rs != rs:
+                continue
+            counts[peer_id] = counts.get(peer_id, 0) + count
+        return counts
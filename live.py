@@ -0,0 +1,181 @@
+# Copyright 2019 Vladislav Pavkin
+
+import json
+import logging
+from collections import deque
+from threading import Condition, Lock, Thread
+
+
+def summary_side(peer) -> dict:
+    # what the summary page shows for one route server of a pair
+    if peer is None:
+        return None
+    return {
+        'peer_id': peer.peer_id,
+        'state': peer.state,
+        'imported_routes': peer.imported_routes,
+        'filtered_routes': peer.filtered_routes,
+        'last_event_time': peer.last_event_time,
+        # the page tells how long ago from this, so rows change only when the peer does
+        'last_event_timestamp': peer.last_event_timestamp,
+    }
+
+
+def summary_row(pair) -> dict:
+    return {
+        'rs1': summary_side(pair.get('rs1')),
+        'rs2': summary_side(pair.get('rs2')),
+    }
+
+
+class SummaryChannel:
+    # the latest summary rows of a service/family and a short log of what changed
+    #
+    # every change bumps seq; a watcher knowing seq N gets the rows changed
+    # after N merged together, or the whole table if N is no longer in the log
+
+    def __init__(self, backlog=1000, hidden_asns=()):
+        self.hidden_asns = set(hidden_asns)
+        self.seq = 0
+        self.rows = {}  # str(pair value) -> summary_row()
+        self.updates = deque(maxlen=backlog)  # (seq, {key: row or None})
+        self.watchers = 0
+        self.poller = None
+        self.condition = Condition()
+
+    def publish(self, pairs) -> int:
+        rows = {str(pair['value']): summary_row(pair)
+                for pair in pairs if pair['neighbor_as'] not in self.hidden_asns}
+
+        with self.condition:
+            changed = {key: row for key, row in rows.items() if self.rows.get(key) != row}
+            for key in self.rows.keys() - rows.keys():
+                changed[key] = None
+            self.rows = rows
+
+            if changed:
+                self.seq += 1
+                self.updates.append((self.seq, changed))
+                self.condition.notify_all()
+
+            return self.seq
+
+    def since(self, seq) -> (int, dict):
+        with self.condition:
+            if seq == self.seq:
+                return self.seq, {}
+
+            # the watcher is ahead (the app was restarted) or too far behind
+            if seq > self.seq or not self.updates or self.updates[0][0] > seq + 1:
+                return self.seq, dict(self.rows)
+
+            merged = {}
+            for update_seq, changed in self.updates:
+                if update_seq > seq:
+                    merged.update(changed)
+            return self.seq, merged
+
+    def wait(self, seq, timeout) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.seq != seq, timeout)
+
+
+class SummaryFeed:
+    # pushes summary changes to any number of watchers from a single poller
+    #
+    # one poller thread per service/family runs while somebody watches it,
+    # so the route servers are queried the same way for one or for hundreds
+    # of open summary pages
+    #
+    # every watcher holds a server thread for as long as its page is open,
+    # at most max_watchers are let in, so the other pages keep being served
+
+    def __init__(self, fetch, interval=30, keepalive=15, backlog=1000, hidden_asns=(), max_watchers=100):
+        self.fetch = fetch  # fetch(service, ip_version) -> list of pairs
+        self.interval = interval
+        self.keepalive = keepalive
+        self.backlog = backlog
+        self.hidden_asns = hidden_asns
+        self.max_watchers = max_watchers
+        self.watchers = 0
+
+        self._channels = {}
+        self._lock = Lock()
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return self.watchers >= self.max_watchers
+
+    def channel(self, service, ip_version) -> SummaryChannel:
+        key = (service, ip_version)
+        with self._lock:
+            if key not in self._channels:
+                self._channels[key] = SummaryChannel(backlog=self.backlog, hidden_asns=self.hidden_asns)
+            return self._channels[key]
+
+    def publish(self, service, ip_version, pairs) -> int:
+        return self.channel(service, ip_version).publish(pairs)
+
+    def stream(self, service, ip_version, seq=0):
+        # server-sent events: one 'rows' event per change, comments as keepalives
+        channel = self.channel(service, ip_version)
+        if not self._admit():
+            # filled up since is_full() was asked, the page retries later
+            yield 'retry: %s\n\n' % (self.interval * 1000)
+            return
+        self._watch(channel, service, ip_version)
+
+        try:
+            yield 'retry: %s\n\n' % (self.keepalive * 1000)
+
+            while True:
+                seq, rows = channel.since(seq)
+                if rows:
+                    yield 'id: %s\nevent: rows\ndata: %s\n\n' % (seq, json.dumps(rows))
+
+                if not channel.wait(seq, self.keepalive):
+                    yield ': keepalive\n\n'
+        finally:
+            self._unwatch(channel)
+
+    def _admit(self) -> bool:
+        with self._lock:
+            if self.watchers >= self.max_watchers:
+                return False
+            self.watchers += 1
+            return True
+
+    def _watch(self, channel, service, ip_version):
+        with channel.condition:
+            channel.watchers += 1
+            if channel.poller is None or not channel.poller.is_alive():
+                channel.poller = Thread(target=self._poll, args=[channel, service, ip_version], daemon=True)
+                channel.poller.start()
+
+    def _unwatch(self, channel):
+        with channel.condition:
+            channel.watchers -= 1
+            channel.condition.notify_all()
+        with self._lock:
+            self.watchers -= 1
+
+    def _poll(self, channel, service, ip_version):
+        while True:
+            with channel.condition:
+                if not channel.watchers:
+                    channel.poller = None
+                    return
+
+            try:
+                pairs = self.fetch(service, ip_version)
+            except Exception:
+                # keep the poller alive, the next round may succeed
+                logging.exception('%s ipv%s summary poll failed', service, ip_version)
+                pairs = None
+
+            if pairs is not None:
+                channel.publish(pairs)
+
+            # sleeps the interval, wakes up earlier when the last watcher leaves
+            with channel.condition:
+                channel.condition.wait_for(lambda: not channel.watchers, self.interval)
@@ -1,15 +1,31 @@
 # Copyright 2019 Vladislav Pavkin
 
+import operator
 import re
-from datetime import datetime
+from array import array
+from datetime import datetime, timedelta
 from ipaddress import ip_address
+from itertools import chain, compress, groupby, islice
+from operator import itemgetter
 from socket import gaierror
+from time import time
 from typing import Optional
+from uuid import uuid4
 
 import paramiko
 from paramiko.ssh_exception import SSHException
 
 import config
+from admission import CommandBudget
+
+# routes of a peer shown on its routes page, and dump lines read for them at most
+PEER_ROUTES_LIMIT = 300
+ROUTE_DUMP_LINES = 50
+
+BATCH_SEPARATOR = '--- py-lg batch %s ---'
+
+RE_PROTOCOL = re.compile(r'\[(peer\d?_\d+)')
+RE_PATH_TIME = re.compile(r'\[peer\d?_\d+ (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)')
 
 RE_IPv4 = re.compile(
     r'^\d{1,4}\.\d{1,4}\.\d{1,4}\.\d{1,4}\/\d{1,2}'
@@ -64,6 +80,7 @@ class Peer(RequiredAttrs):
     import_limit = None
     source_address = None
     last_event_time = None
+    last_event_timestamp = None  # last_event_time as unix time, parsed once
     imported_routes = None
     filtered_routes = None
     exported_routes = None
@@ -91,6 +108,7 @@ class Peer(RequiredAttrs):
         self.bgp_state = self._parse_bgp_state()
         self.bgp_state_details = self._parse_bgp_state_details()
         self.last_event_time = self._parse_last_event_time()
+        self.last_event_timestamp = self._parse_last_event_timestamp()
         self.description = self._parse_description()
         self.preference = self._parse_preference()
         self.import_limit = self._parse_import_limit()
@@ -137,6 +155,13 @@ class Peer(RequiredAttrs):
         last_event_time = " ".join(parts[4:6])
         return last_event_time
 
+    def _parse_last_event_timestamp(self):
+        try:
+            last_event_time = datetime.strptime(self.last_event_time, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
+        return last_event_time.timestamp()
+
     def _parse_state(self):
         """
         peer_12217 BGP      master   up     2018-02-07 21:40:48  Established
@@ -201,9 +226,11 @@ class Peer(RequiredAttrs):
                 word = parts[position]
         return word
 
-    def persistency(self):
-        last_event_time = datetime.strptime(self.last_event_time, "%Y-%m-%d %H:%M:%S")
-        difference = datetime.now() - last_event_time
+    def persistency(self, now=None):
+        if self.last_event_timestamp is None:
+            return ''
+
+        difference = timedelta(seconds=(now or time()) - self.last_event_timestamp)
 
         if difference.days < 1:
             total_minutes = difference.seconds / 60
@@ -215,6 +242,121 @@ class Peer(RequiredAttrs):
             return "%s days" % difference.days
 
 
+STATE_ABSENT = -1
+STATE_DOWN = 0
+STATE_UP = 1
+STATE_OTHER = 2
+
+STATE_CODES = {
+    'down': STATE_DOWN,
+    'up': STATE_UP,
+}
+
+_BIT_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+_BIT_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+class Summary:
+    # a columnar view over rs1/rs2 peer pairs, used for summary page filtering
+    #
+    # rows are kept ordered by the latest state change on either route server,
+    # so a selection is a python int with bit N set for row N: the interval
+    # filter is a low bits mask, state and AS filters are precomputed bitsets
+
+    def __init__(self, pairs):
+        rs1_time = [self._event_time(pair.get('rs1')) for pair in pairs]
+        rs2_time = [self._event_time(pair.get('rs2')) for pair in pairs]
+        latest = list(map(max, rs1_time, rs2_time))
+        recency = sorted(range(len(pairs)), key=latest.__getitem__, reverse=True)
+
+        self.pairs = [pairs[idx] for idx in recency]
+        self.size = len(self.pairs)
+
+        self.value = [pair['value'] for pair in self.pairs]
+        self.neighbor_as = [pair['neighbor_as'] or 0 for pair in self.pairs]
+        self.latest_event_time = array('d', [latest[idx] for idx in recency])
+
+        rs1_state = self._state_column('rs1')
+        rs2_state = self._state_column('rs2')
+
+        self.order = sorted(range(self.size), key=self.value.__getitem__)
+        self.mask = (1 << self.size) - 1
+
+        self._state_bits = {}
+        for code in STATE_CODES.values():
+            self._state_bits[code] = self._bits(map(operator.or_,
+                                                    map(code.__eq__, rs1_state),
+                                                    map(code.__eq__, rs2_state)))
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    @staticmethod
+    def _event_time(peer):
+        if peer is None:
+            return 0.0
+        return peer.last_event_timestamp or 0.0
+
+    @staticmethod
+    def _bits(flags):
+        # [True, False, True] -> 0b101
+        digits = bytes(flags)[::-1].translate(_BIT_DIGITS)
+        return int(digits or b'0', 2)
+
+    def _state_column(self, rs):
+        return array('b', [STATE_ABSENT if pair.get(rs) is None else STATE_CODES.get(pair[rs].state, STATE_OTHER)
+                           for pair in self.pairs])
+
+    def hide_asns(self, asns):
+        # drops pairs whose neighbor AS is in asns
+        hidden = 0
+        for asn in set(asns):
+            # list.index() scans the column in C, a few hidden ASNs are the usual case
+            idx = -1
+            while True:
+                try:
+                    idx = self.neighbor_as.index(asn, idx + 1)
+                except ValueError:
+                    break
+                hidden |= 1 << idx
+        self.mask &= ~hidden
+        return self
+
+    def changed_within(self, minutes, now=None):
+        # keeps pairs with a state change on either route server during the last minutes
+        since = (now or time()) - minutes * 60
+
+        # latest_event_time is descending, count rows newer than since
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.latest_event_time[middle] > since:
+                low = middle + 1
+            else:
+                high = middle
+
+        self.mask &= (1 << low) - 1
+        return self
+
+    def with_state(self, state):
+        # keeps pairs being in a given state ('up', 'down') on either route server
+        self.mask &= self._state_bits[STATE_CODES[state]]
+        return self
+
+    def rows(self, now=None):
+        # selected pairs, sorted by neighbor address, with what the page shows of them precomputed
+        flags = format(self.mask, 'b').zfill(self.size)[::-1].encode().translate(_BIT_FLAGS)
+        selected = compress(self.order, map(flags.__getitem__, self.order))
+        pairs = [self.pairs[idx] for idx in selected]
+
+        now = now or time()
+        for pair in pairs:
+            for rs in ('rs1', 'rs2'):
+                peer = pair.get(rs)
+                pair[rs + '_persistency'] = '%s %s' % (peer.persistency(now), peer.state) if peer else ''
+        return pairs
+
+
 class Route:
     # a product or 'show route' bird command
 
@@ -250,9 +392,10 @@ class Route:
 
 
 class RouteServer:
-    def __init__(self, server=None):
+    def __init__(self, server=None, budget=None):
         self._session = None
         self.server = server
+        self.budget = budget or CommandBudget(server)  # commands run on the server at once
         self.connect()
 
     def connect(self):
@@ -269,15 +412,60 @@ class RouteServer:
         self._session.close()
 
     def _cmd(self, command):
+        # raises Overloaded when the server runs as many commands as its budget allows
+        with self.budget:
+            return self._exec(command)
+
+    def _exec(self, command):
         try:
             stdin, stdout, stderr = self._session.exec_command(command, timeout=5)
         except (TimeoutError, SSHException):
             self.connect()
-            self._cmd(command)
+            return self._exec(command)
         else:
             bird_dump_bytes = stdout.read()
             return bird_dump_bytes.decode("utf-8")
 
+    def _cmds(self, commands) -> list:
+        # runs several server commands in one exec round trip, outputs are told apart by a separator line
+        separator = BATCH_SEPARATOR % uuid4().hex
+        bird_dump = self._cmd(self._batch_command(commands, separator))
+        return self._split_batch(bird_dump, separator, len(commands))
+
+    @staticmethod
+    def _batch_command(commands, separator):
+        # the bare echo ends an output that has no newline at its end, so the separator is on a line of its own
+        return ('; echo; echo "%s"; ' % separator).join(commands)
+
+    @staticmethod
+    def _split_batch(bird_dump, separator, count) -> list:
+        outputs = [[]]
+        for line in (bird_dump or '').splitlines():
+            if line == separator:
+                # the line of the bare echo
+                if outputs[-1] and not outputs[-1][-1]:
+                    outputs[-1].pop()
+                outputs.append([])
+            else:
+                outputs[-1].append(line)
+
+        outputs = ['\n'.join(lines) + '\n' for lines in outputs]
+        outputs.extend([''] * (count - len(outputs)))
+        return outputs[:count]
+
+    def _cmd_lines(self, command, budget=None):
+        # same as _cmd(), but yields the output line by line, for dumps too big to read at once;
+        # the slot of `budget` (the server's own if None) is held until the last line is read
+        with budget or self.budget:
+            try:
+                stdin, stdout, stderr = self._session.exec_command(command, timeout=5)
+            except (TimeoutError, SSHException):
+                self.connect()
+                stdin, stdout, stderr = self._session.exec_command(command, timeout=5)
+
+            for line in stdout:
+                yield line.rstrip('\n')
+
     def _parse__show_protocols(self, bird_dump, ip_version=4):
         peers_lines = []
         peer_lines = []
@@ -316,17 +504,30 @@ class RouteServer:
             blocks.append(dump)
         return blocks
 
+    @staticmethod
+    def _parse__show_route_table(lines):
+        # splits a 'show route all' dump into (destination, path dump) pairs;
+        # only the first path of a destination starts with the prefix itself
+        destination = None
+        block = []
+
+        for line in lines:
+            if 'unicast' in line:
+                if block:
+                    yield destination, '\n'.join(block)
+                block = [line]
+                if not line[:1].isspace():
+                    destination = line.split()[0]
+            elif block:
+                block.append(line)
+        if block:
+            yield destination, '\n'.join(block)
+
     def route(self, destination=None, service=None, ip_version=None) -> Optional[Route]:
         if self._session is None:
             return
 
-        if '/' in destination:
-            bird_command = "show route %s all" % destination
-        else:
-            bird_command = "show route for %s all" % destination
-
-        server_command = '/var/run/bird.%s.ctl %s' % (service, bird_command)
-        bird_dump = self._cmd(server_command)
+        bird_dump = self._cmd(self._route_command(destination, service))
 
         route = Route(dump=bird_dump, ip_version=ip_version)
         return route
@@ -335,11 +536,23 @@ class RouteServer:
         if self._session is None:
             return []
 
+        bird_dump = self._cmd(self._peers_command(service))
+        return self._parse_peers(bird_dump, ip_version)
+
+    @staticmethod
+    def _route_command(destination, service):
+        if '/' in destination:
+            bird_command = "show route %s all" % destination
+        else:
+            bird_command = "show route for %s all" % destination
+        return '/var/run/bird.%s.ctl %s' % (service, bird_command)
+
+    @staticmethod
+    def _peers_command(service):
         bird_command = 'show protocols all'
-        server_command = '/var/run/bird.%s.ctl %s' % (
-            service, bird_command)
-        bird_dump = self._cmd(server_command)
+        return '/var/run/bird.%s.ctl %s' % (service, bird_command)
 
+    def _parse_peers(self, bird_dump, ip_version) -> list:
         peers = []
         protocols_dump = self._parse__show_protocols(bird_dump, ip_version)
         for peer_dump in protocols_dump:
@@ -355,47 +568,87 @@ class RouteServer:
         if self._session is None:
             return
 
-        peer_id = peer_id.replace('peer_', 'peer%s_' % ip_version)
-
-        bird_command = 'show protocols all %s' % peer_id
-        server_command = '/var/run/bird.%s.ctl %s' % (service, bird_command)
-        bird_dump = self._cmd(server_command)
-
-        peers = []
-        parsed_protocols = self._parse__show_protocols(bird_dump=bird_dump, ip_version=ip_version)
-        for peer_dump in parsed_protocols:
-            try:
-                peer = Peer(peer_dump, ip_version)
-            except ParsingError:
-                pass
-            else:
-                peers.append(peer)
-
-        if peers:
-            return peers[0]
-        return None
+        bird_dump = self._cmd(self._peer_command(peer_id, service, ip_version))
+        return self._parse_peer(bird_dump, ip_version)
 
     def peer_routes(self, peer_id, rejected, service=None, ip_version=None) -> (Peer, list):
         if self._session is None:
             return None, []
 
-        peer = self.peer(peer_id, service=service, ip_version=ip_version)
+        # the peer and its routes in one round trip
+        peer_dump, routes_dump = self._cmds(self._peer_routes_commands(peer_id, rejected, service, ip_version))
+        return self._parse_peer_routes(peer_dump, routes_dump, rejected, ip_version)
+
+    def _peer_routes_commands(self, peer_id, rejected, service, ip_version) -> list:
+        # routes are cut to what the page may show, so a peer with
+        # a full view does not send it all only to be dropped
+        routes_command = '%s | head -n %s' % (self._routes_command(peer_id, rejected, service, ip_version),
+                                               PEER_ROUTES_LIMIT * ROUTE_DUMP_LINES)
+        return [self._peer_command(peer_id, service, ip_version), routes_command]
+
+    def _parse_peer_routes(self, peer_dump, routes_dump, rejected, ip_version) -> (Peer, list):
+        peer = self._parse_peer(peer_dump, ip_version)
+        if peer is None:
+            return None, []
 
-        if not rejected and peer.imported_routes > 300:
+        if not rejected and peer.imported_routes > PEER_ROUTES_LIMIT:
             return peer, []
 
-        if rejected and peer.filtered_routes > 300:
+        if rejected and peer.filtered_routes > PEER_ROUTES_LIMIT:
             return peer, []
 
+        return peer, self._parse_routes(routes_dump, rejected, ip_version)
+
+    def protocol_routes(self, peer_id, rejected=False, service=None, ip_version=None) -> list:
+        if self._session is None:
+            return []
+
+        dump = self._cmd(self._routes_command(peer_id, rejected, service, ip_version))
+        return self._parse_routes(dump, rejected, ip_version)
+
+    def protocol_paths(self, peer_id, rejected=False, service=None, ip_version=None):
+        # same as protocol_routes(), but parsed while the dump is still being read,
+        # one path at a time, for peers with too many routes to hold at once
+        if self._session is None:
+            return
+
+        command = self._routes_command(peer_id, rejected, service, ip_version)
+        for destination, path_dump in self._parse__show_route_table(self._cmd_lines(command)):
+            prefix = BGPPrefix(dump=path_dump, ip_version=ip_version, destination=destination)
+            if rejected:
+                prefix.filtered = True
+            yield prefix
+
+    @staticmethod
+    def _peer_command(peer_id, service, ip_version):
+        peer_id = peer_id.replace('peer_', 'peer%s_' % ip_version)
+        bird_command = 'show protocols all %s' % peer_id
+        return '/var/run/bird.%s.ctl %s' % (service, bird_command)
+
+    @staticmethod
+    def _routes_command(peer_id, rejected, service, ip_version):
         peer_id = peer_id.replace('peer_', 'peer%s_' % ip_version)
         bird_command = 'show route protocol %s all' % peer_id
         if rejected:
             bird_command = 'show route protocol %s filtered all' % peer_id
+        return '/var/run/bird.%s.ctl %s' % (service, bird_command)
 
-        server_command = '/var/run/bird.%s.ctl %s' % (service, bird_command)
+    def _parse_peer(self, bird_dump, ip_version) -> Optional[Peer]:
+        peers = []
+        parsed_protocols = self._parse__show_protocols(bird_dump=bird_dump, ip_version=ip_version)
+        for peer_dump in parsed_protocols:
+            try:
+                peer = Peer(peer_dump, ip_version)
+            except ParsingError:
+                pass
+            else:
+                peers.append(peer)
 
-        dump = self._cmd(server_command)
+        if peers:
+            return peers[0]
+        return None
 
+    def _parse_routes(self, dump, rejected, ip_version) -> list:
         routes = []
         route_dumps = self._parse__show_route_peer(dump)
 
@@ -406,7 +659,24 @@ class RouteServer:
                 prefix.filtered = True
             routes.append(prefix)
 
-        return peer, routes
+        return routes
+
+    def table(self, service=None, ip_version=None, offset=0, budget=None):
+        # every path of the service/family table, parsed while the dump is still being read;
+        # the paths of the first `offset` prefixes are skipped without being parsed
+        if self._session is None:
+            return
+
+        bird_command = 'show route table master%s all' % ip_version
+        server_command = '/var/run/bird.%s.ctl %s' % (service, bird_command)
+
+        path_dumps = self._parse__show_route_table(self._cmd_lines(server_command, budget))
+        if offset:
+            prefixes = groupby(path_dumps, key=itemgetter(0))
+            path_dumps = chain.from_iterable(dumps for destination, dumps in islice(prefixes, offset, None))
+
+        for destination, path_dump in path_dumps:
+            yield BGPPrefix(dump=path_dump, ip_version=ip_version, destination=destination)
 
 
 class BGPPrefix:
@@ -423,6 +693,7 @@ class BGPPrefix:
         self.local_pref = None
         self.preferred = False
         self.next_hop_netname = None
+        self.peer_id = None
 
         if destination:
             self.destination = destination
@@ -453,6 +724,24 @@ class BGPPrefix:
         self.communities = self._parse_communities()
         self.as_path = self._parse_as_path()
         self.preferred = self._parse_preferred()
+        self.peer_id = self._parse_peer_id()
+        self.time = self._parse_time()
+
+    def _parse_time(self):
+        # unicast [peer4_12217 2018-02-07 21:40:48] * (100) [AS12217i]
+        for line in self._dump:
+            result = RE_PATH_TIME.search(line)
+            if result:
+                return result.group(1)
+        return None
+
+    def _parse_peer_id(self):
+        # unicast [peer4_12217 2018-02-07 21:40:48] * (100) [AS12217i]
+        for line in self._dump:
+            result = RE_PROTOCOL.search(line)
+            if result:
+                return re.sub(r'^peer\d_', 'peer_', result.group(1))
+        return None
 
     def _parse_preferred(self):
         for line in self._dump:
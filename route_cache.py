@@ -0,0 +1,133 @@
+# Copyright 2019 Vladislav Pavkin
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class RouteCache:
+    # a bounded LRU of parsed 'show route' results of every route server
+    #
+    # entries are kept per (rs, service, ip_version, prefix); an address lookup
+    # ('show route for') is stored under the prefix it resolved to plus an alias
+    # from that exact address. A later lookup of the prefix, or of that address,
+    # is answered from the entry. Other addresses of the prefix still go to BIRD
+    # once each: BIRD may hold a more specific route for them, which a cached
+    # covering prefix cannot rule out
+
+    def __init__(self, route_servers, size=10000, ttl=60):
+        self.route_servers = route_servers  # {'rs1': RouteServer, 'rs2': RouteServer}
+        self.size = size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # (rs, service, ip_version, prefix) -> (expires, Route), LRU order
+        self._aliases = {}  # (rs, service, ip_version, address) -> prefix
+        self._aliased = {}  # (rs, service, ip_version, prefix) -> set of addresses resolved to it
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def route(self, rs, destination=None, service=None, ip_version=None):
+        # same as RouteServer.route() of the rs route server, answered from the cache when possible
+        scope = (rs, service, ip_version)
+        route = self._lookup(scope, destination)
+        if route is None:
+            route = self.route_servers[rs].route(destination=destination, service=service, ip_version=ip_version)
+            self._store(scope, destination, route)
+        return route
+
+    async def route_async(self, rs, destination=None, service=None, ip_version=None):
+        # route() for AsyncRouteServer route servers
+        scope = (rs, service, ip_version)
+        route = self._lookup(scope, destination)
+        if route is None:
+            route = await self.route_servers[rs].route(destination=destination, service=service, ip_version=ip_version)
+            self._store(scope, destination, route)
+        return route
+
+    def _lookup(self, scope, destination):
+        with self._lock:
+            route = self._get(scope, destination)
+            if route is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return route
+
+    def _store(self, scope, destination, route):
+        if route is None:
+            # the route server is not reachable, nothing to keep
+            return
+
+        with self._lock:
+            self._put(scope, destination, route)
+
+    def _get(self, scope, destination):
+        prefix = self._aliases.get(scope + (destination,), destination)
+        key = scope + (prefix,)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, route = entry
+        if expires < time():
+            self._drop(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return route
+
+    def _put(self, scope, destination, route):
+        # a route not found has no destination, it is kept under what was asked for
+        prefix = route.destination or destination
+        key = scope + (prefix,)
+
+        self._entries[key] = (time() + self.ttl, route)
+        self._entries.move_to_end(key)
+        if prefix != destination:
+            alias = scope + (destination,)
+            previous = self._aliases.get(alias)
+            if previous is not None and previous != prefix:
+                self._aliased.get(scope + (previous,), set()).discard(destination)
+            self._aliases[alias] = prefix
+            self._aliased.setdefault(key, set()).add(destination)
+
+        # addresses count as entries, so lookups of many addresses of one prefix stay bounded too
+        while len(self._entries) + len(self._aliases) > self.size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        # drops the entry of a prefix together with the addresses resolved to it
+        del self._entries[key]
+        for address in self._aliased.pop(key, ()):
+            del self._aliases[key[:3] + (address,)]
+
+    def invalidate(self, rs, service, ip_version, peer_ids):
+        # drops the prefixes any of the given peers had a path for
+        peer_ids = set(peer_ids)
+        scope = (rs, service, ip_version)
+
+        with self._lock:
+            stale = [key for key, (expires, route) in self._entries.items()
+                     if key[:3] == scope and any(path.peer_id in peer_ids for path in route.paths)]
+            for key in stale:
+                self._drop(key)
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'aliases': len(self._aliases),
+                'max_size': self.size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
@@ -0,0 +1,112 @@
+# Copyright 2019 Vladislav Pavkin
+
+from route_index import prefix_key
+
+# path attributes a diff may compare besides the prefix itself
+ATTRIBUTES = ('next_hop', 'as_path')
+
+
+class RouteSet:
+    # prefixes of a table, with the attributes of their paths if asked for
+    #
+    # prefixes are kept as (interned) strings: their hashes are cached, so set
+    # operations over them are cheaper than encoding every prefix first; only
+    # the differences get encoded, to be sorted numerically
+
+    def __init__(self, records, attributes=()):
+        # records are (prefix, next_hop, as_path) tuples, as_path being a tuple of ints
+        for attribute in attributes:
+            if attribute not in ATTRIBUTES:
+                raise ValueError('Wrong attribute given: %s' % attribute)
+
+        self.attributes = tuple(attribute for attribute in ATTRIBUTES if attribute in attributes)
+        self.prefixes = set()
+        self.paths = {}  # prefix -> (next_hop, as_path) or a set of them, only compared attributes are set
+
+        with_next_hop = 'next_hop' in self.attributes
+        with_as_path = 'as_path' in self.attributes
+
+        if not self.attributes:
+            self.prefixes.update(prefix for prefix, next_hop, as_path in records)
+            return
+
+        # a prefix with a single path keeps the path itself, a set is made for the second one only;
+        # sets always hold two or more paths, so comparing the values compares the paths
+        paths = self.paths
+        for prefix, next_hop, as_path in records:
+            path = (next_hop if with_next_hop else None, as_path if with_as_path else None)
+            known = paths.get(prefix)
+            if known is None:
+                paths[prefix] = path
+            elif type(known) is set:
+                known.add(path)
+            elif known != path:
+                paths[prefix] = {known, path}
+        self.prefixes.update(paths)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    @classmethod
+    def from_paths(cls, paths, attributes=()):
+        # from BGPPrefix objects, as returned by RouteServer.route() and RouteServer.protocol_routes()
+        records = ((path.destination, path.next_hop, tuple(map(int, path.as_path))) for path in paths)
+        return cls(records, attributes)
+
+
+class RouteDiff:
+    # what one route set has and the other lacks, by prefix and optionally by path attributes
+
+    def __init__(self, left, right):
+        self.attributes = left.attributes
+        self.left = left
+        self.right = right
+
+        self.only_left = sorted(left.prefixes - right.prefixes, key=prefix_key)
+        self.only_right = sorted(right.prefixes - left.prefixes, key=prefix_key)
+
+        common = left.prefixes & right.prefixes
+        self.common = len(common)
+
+        self.changed = []
+        if self.attributes:
+            self.changed = sorted((prefix for prefix in common if left.paths[prefix] != right.paths[prefix]),
+                                  key=prefix_key)
+
+    def __bool__(self):
+        return bool(self.only_left or self.only_right or self.changed)
+
+    def as_dict(self, limit=None) -> dict:
+        return {
+            'attributes': list(self.attributes),
+            'left': len(self.left),
+            'right': len(self.right),
+            'common': self.common,
+            'only_left_count': len(self.only_left),
+            'only_right_count': len(self.only_right),
+            'changed_count': len(self.changed),
+            'only_left': self.only_left[:limit],
+            'only_right': self.only_right[:limit],
+            'changed': [self._changed(prefix) for prefix in self.changed[:limit]],
+        }
+
+    def _changed(self, prefix) -> dict:
+        return {
+            'prefix': prefix,
+            'left': self._paths(self.left.paths[prefix]),
+            'right': self._paths(self.right.paths[prefix]),
+        }
+
+    def _paths(self, paths) -> list:
+        if type(paths) is not set:
+            paths = [paths]
+        return [self._path(path) for path in sorted(paths, key=str)]
+
+    def _path(self, path) -> dict:
+        next_hop, as_path = path
+        result = {}
+        if 'next_hop' in self.attributes:
+            result['next_hop'] = next_hop
+        if 'as_path' in self.attributes:
+            result['as_path'] = list(as_path)
+        return result
@@ -0,0 +1,194 @@
+# Copyright 2019 Vladislav Pavkin
+
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+# Peer counters followed by the history, in slot order; the imported routes go first,
+# the coarser tiers keep them only
+HISTORY_FIELDS = (
+    'imported_routes',
+    'filtered_routes',
+    'exported_routes',
+    'preferred_routes',
+)
+
+# (seconds per slot, slots, counters): 12 hours by 5 minutes, a week by hours, 30 days by 6 hours;
+# a tier keeps the first `counters` of HISTORY_FIELDS, only the imported routes past 12 hours
+HISTORY_TIERS = (
+    (300, 144, 4),
+    (3600, 168, 1),
+    (21600, 120, 1),
+)
+
+NO_SAMPLE = 0xFFFFFFFF  # a slot no summary refresh fell into, above any real count
+
+
+class PeerHistory:
+    # route counters of one peer on one route server, every tier in one integer array
+    #
+    # a tier is a ring of slots, slot N of a tier holds the counters of time bucket
+    # `bucket % slots`; a slot keeps the smallest count seen in its bucket, so a
+    # drop shows up on every tier, however short it was
+
+    __slots__ = ('counts', 'buckets')
+
+    def __init__(self, tiers):
+        self.counts = array('I', [NO_SAMPLE]) * sum(slots * counters for step, slots, counters in tiers)
+        self.buckets = [-1] * len(tiers)  # the latest bucket written on each tier
+
+    def add(self, tiers, now, values):
+        start = 0
+        for tier, (step, slots, counters) in enumerate(tiers):
+            bucket = int(now // step)
+            last = self.buckets[tier]
+
+            if bucket > last:
+                # buckets nobody sampled since the last write are empty; a new series is empty already
+                if last >= 0:
+                    empty = array('I', [NO_SAMPLE]) * counters
+                    for skipped in range(max(last + 1, bucket - slots + 1), bucket + 1):
+                        offset = start + skipped % slots * counters
+                        self.counts[offset:offset + counters] = empty
+                self.buckets[tier] = bucket
+
+            if bucket > last - slots:
+                offset = start + bucket % slots * counters
+                for field in range(counters):
+                    self.counts[offset + field] = min(self.counts[offset + field], values[field])
+
+            start += slots * counters
+
+    def tier(self, tiers, tier, now) -> list:
+        # [(bucket start time, counters or None)] of the tier, oldest first, up to the bucket of `now`;
+        # counters are the first ones of HISTORY_FIELDS the tier keeps
+        step, slots, counters = tiers[tier]
+        start = sum(tier_slots * tier_counters for tier_step, tier_slots, tier_counters in tiers[:tier])
+        current = int(now // step)
+        last = self.buckets[tier]
+
+        rows = []
+        for bucket in range(current - slots + 1, current + 1):
+            values = None
+            if last - slots < bucket <= last:
+                offset = start + bucket % slots * counters
+                values = self.counts[offset:offset + counters].tolist()
+                if values[0] == NO_SAMPLE:
+                    values = None
+            rows.append((bucket * step, values))
+        return rows
+
+
+class RouteHistory:
+    # time series of the route counters of every peer, fed by each summary refresh
+    #
+    # a series is one peer on one route server in one family, so a peer of both
+    # route servers in both families takes four
+    #
+    # memory is fixed: a series is about 3.5 KiB whatever the uptime, and at most
+    # `size` series are kept, the ones refreshed least recently are dropped first;
+    # a size below what the summaries refresh drops series on every refresh
+
+    def __init__(self, size=40000, tiers=HISTORY_TIERS):
+        self.size = size
+        self.tiers = tuple(tiers)
+
+        self._series = OrderedDict()  # (rs, service, ip_version, peer_id) -> PeerHistory
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def update(self, rs, service, ip_version, peers, now=None):
+        # an empty list means the route server was not reachable, not that every count dropped
+        if not peers:
+            return
+
+        now = now or time()
+        with self._lock:
+            for peer in peers:
+                key = (rs, service, ip_version, peer.peer_id)
+                series = self._series.get(key)
+                if series is None:
+                    if len(self._series) >= self.size:
+                        self._series.popitem(last=False)
+                    series = self._series[key] = PeerHistory(self.tiers)
+                else:
+                    self._series.move_to_end(key)
+
+                values = [min(getattr(peer, field) or 0, NO_SAMPLE - 1) for field in HISTORY_FIELDS]
+                series.add(self.tiers, now, values)
+
+    def get(self, rs, service, ip_version, peer_id, tier=0, now=None) -> list:
+        # [(bucket start time, counters or None)] of a tier, empty for peers never seen
+        now = now or time()
+        with self._lock:
+            series = self._series.get((rs, service, ip_version, peer_id))
+            if series is None:
+                return []
+            return series.tier(self.tiers, tier, now)
+
+    def as_dict(self, rs, service, ip_version, peer_id, now=None) -> dict:
+        # every tier of a peer, one list per counter, None where nothing was sampled
+        now = now or time()
+        tiers = []
+        for tier, (step, slots, counters) in enumerate(self.tiers):
+            rows = self.get(rs, service, ip_version, peer_id, tier, now)
+            tiers.append({
+                'step': step,
+                'start': rows[0][0] if rows else None,
+                'values': {field: [values[index] if values else None for stamp, values in rows]
+                           for index, field in enumerate(HISTORY_FIELDS[:counters])},
+            })
+        return {'rs': rs, 'peer_id': peer_id, 'fields': list(HISTORY_FIELDS), 'tiers': tiers}
+
+    def stats(self) -> dict:
+        series_bytes = sum(slots * counters for step, slots, counters in self.tiers) * 4
+        with self._lock:
+            series = len(self._series)
+        return {
+            'series': series,
+            'size': self.size,
+            'tiers': [{'step': step, 'slots': slots, 'fields': list(HISTORY_FIELDS[:counters])}
+                      for step, slots, counters in self.tiers],
+            'bytes_per_series': series_bytes,
+            'max_bytes': self.size * series_bytes,
+        }
+
+
+def sparkline(rows, field='imported_routes', width=300, height=40) -> dict:
+    # SVG polyline points of one counter of a tier; gaps in the series break the line,
+    # a counter the tier does not keep gives no line
+    index = HISTORY_FIELDS.index(field)
+    values = [row_values[index] if row_values and index < len(row_values) else None for stamp, row_values in rows]
+    known = [value for value in values if value is not None]
+    if not known:
+        return {}
+
+    low, high = min(known), max(known)
+    x_step = width / max(len(values) - 1, 1)
+    y_scale = (height - 2) / (high - low) if high > low else 0
+
+    lines = []
+    points = []
+    for position, value in enumerate(values):
+        if value is None:
+            if points:
+                lines.append(' '.join(points))
+                points = []
+            continue
+        y = height - 1 - (value - low) * y_scale if y_scale else height / 2
+        points.append('%.1f,%.1f' % (position * x_step, y))
+    if points:
+        lines.append(' '.join(points))
+
+    return {
+        'lines': lines,
+        'width': width,
+        'height': height,
+        'low': low,
+        'high': high,
+        'last': known[-1],
+        'start': rows[0][0],
+    }
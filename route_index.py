@@ -0,0 +1,426 @@
+# Copyright 2019 Vladislav Pavkin
+
+import heapq
+import logging
+import re
+import sys
+from array import array
+from itertools import groupby
+from socket import AF_INET, AF_INET6, inet_pton
+from threading import Lock, Thread
+from time import sleep, time
+
+
+def prefix_key(prefix) -> bytes:
+    # packed address + mask length, sorts numerically as bytes; unparsable prefixes go first
+    address, _, length = (prefix or '').partition('/')
+    try:
+        return inet_pton(AF_INET6 if ':' in address else AF_INET, address) + bytes((int(length or 0),))
+    except (OSError, ValueError):
+        return b''
+
+
+INDEX_KINDS = ('community', 'origin', 'asn')
+
+
+def community_key(asn, value) -> int:
+    return asn << 32 | value
+
+
+def parse_community(text) -> (int, int):
+    # '1234:9999', '1234,9999' or '(1234,9999)'
+    parts = text.strip().strip('()').replace(':', ',').split(',')
+    if len(parts) != 2 or not all(part.strip().isdecimal() for part in parts):
+        raise ValueError('Wrong community given: %s' % text)
+
+    asn, value = int(parts[0]), int(parts[1])
+    if asn >= 1 << 32 or value >= 1 << 32:
+        raise ValueError('Wrong community given: %s' % text)
+    return asn, value
+
+
+# what an AS-path regex may hold: digits, spaces, '_', '.' and digit classes, each
+# repeated at most by one of '*+?', anchored by '^' and '$' at the ends only
+RE_ASPATH_SAFE = re.compile(r'\^?(?:(?:[\d _.]|\[\^?[\d\- ]+\])[*+?]?)*\$?')
+
+# unbounded repetitions an AS-path regex may have; each one more multiplies
+# the backtracking on a long path by its length
+ASPATH_MAX_REPEATS = 2
+
+
+def aspath_pattern(text):
+    # AS-path regex over space separated ASNs, '_' stands for an ASN boundary: '^174_', '_3356_', '_64500$'
+    #
+    # only a subset of the syntax without groups or alternations is taken, so no
+    # regex given to the search backtracks for long on a path
+    text = text.strip()
+    if not RE_ASPATH_SAFE.fullmatch(text):
+        raise ValueError('Wrong AS-path regex given: only digits, spaces, _ ^ $ . [ ] '
+                         'and one of * + ? after any of them are allowed')
+    if text.count('*') + text.count('+') > ASPATH_MAX_REPEATS:
+        raise ValueError('Wrong AS-path regex given: at most %s of * and + are allowed' % ASPATH_MAX_REPEATS)
+
+    try:
+        return re.compile(text.replace('_', '(?:^| |$)'))
+    except re.error as e:
+        raise ValueError('Wrong AS-path regex given: %s' % e)
+
+
+def required_asns(text) -> list:
+    # ASNs any path matching the regex has to contain, used to narrow the scan down;
+    # alternations, groups and optional parts are not analysed, all paths are scanned then
+    if any(char in text for char in '|()[]{}?\\'):
+        return []
+
+    # the regex is searched unanchored, a bare '3356' matches within '33560' too,
+    # only numbers with a boundary on both sides are whole ASNs; a boundary
+    # followed by '*' or '+' may be missing or repeated, it does not count
+    asns = []
+    for match in re.finditer(r'\d+', text):
+        before = text[match.start() - 1:match.start()]
+        after = text[match.end():match.end() + 1]
+        repeated = text[match.end() + 1:match.end() + 2] in ('*', '+')
+        if before in ('^', '_', ' ') and after in ('$', '_', ' ') and not repeated:
+            asns.append(int(match.group()))
+    return asns
+
+
+class PeerPaths:
+    # paths of one peer as a table dump is read, reduced to what PeerRoutes indexes
+    #
+    # a full table is held this way until every peer is indexed, a few dozen
+    # bytes a path instead of a parsed BGPPrefix
+
+    __slots__ = ('prefixes', 'next_hops', 'as_path_asns', 'as_path_offsets', 'communities', 'community_offsets')
+
+    def __init__(self, paths=()):
+        self.prefixes = []
+        self.next_hops = []
+        self.as_path_asns = array('I')
+        self.as_path_offsets = array('I', [0])
+        self.communities = array('Q')
+        self.community_offsets = array('I', [0])
+
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def add(self, path):
+        self.prefixes.append(sys.intern(path.destination or ''))
+        self.next_hops.append(sys.intern(path.next_hop or ''))
+        self.as_path_asns.extend(int(asn) for asn in path.as_path)
+        self.as_path_offsets.append(len(self.as_path_asns))
+        self.communities.extend(community_key(community.asn, community.value) for community in path.communities)
+        self.community_offsets.append(len(self.communities))
+
+    def row(self, row) -> (str, str, array, array):
+        # (prefix, next hop, AS-path, community keys) of a path
+        return (self.prefixes[row],
+                self.next_hops[row],
+                self.as_path_asns[self.as_path_offsets[row]:self.as_path_offsets[row + 1]],
+                self.communities[self.community_offsets[row]:self.community_offsets[row + 1]])
+
+
+class PeerRoutes:
+    # paths received from one peer on one route server, in a compact form
+    #
+    # AS-paths of all rows are flattened into one integer array, row N owns
+    # as_path_asns[as_path_offsets[N]:as_path_offsets[N + 1]]
+
+    __slots__ = ('rs', 'peer_id', 'stamp', 'prefixes', 'next_hops', 'as_path_asns', 'as_path_offsets', 'rows')
+
+    def __init__(self, rs, peer_id, stamp, paths):
+        # paths: PeerPaths of the peer
+        self.rs = rs
+        self.peer_id = peer_id
+        self.stamp = stamp  # what the peer looked like when its paths were pulled
+
+        self.prefixes = []  # sorted by prefix_key(), so rows of any index are sorted too
+        self.next_hops = []
+        self.as_path_asns = array('I')
+        self.as_path_offsets = array('I', [0])
+        self.rows = {kind: {} for kind in INDEX_KINDS}  # kind -> key -> array of rows in prefixes
+
+        communities = self.rows['community']
+        origins = self.rows['origin']
+        asns = self.rows['asn']
+
+        order = sorted(range(len(paths)), key=lambda path_row: prefix_key(paths.prefixes[path_row]))
+        for row, path_row in enumerate(order):
+            prefix, next_hop, as_path, path_communities = paths.row(path_row)
+            self.prefixes.append(prefix)
+            self.next_hops.append(next_hop)
+
+            for key in path_communities:
+                self._add(communities, key, row)
+
+            self.as_path_asns.extend(as_path)
+            self.as_path_offsets.append(len(self.as_path_asns))
+            if as_path:
+                self._add(origins, as_path[-1], row)
+            for asn in set(as_path):
+                self._add(asns, asn, row)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    @staticmethod
+    def _add(rows_by_key, key, row):
+        rows = rows_by_key.get(key)
+        if rows is None:
+            rows = rows_by_key[key] = array('I')
+        rows.append(row)
+
+    def as_path(self, row) -> array:
+        return self.as_path_asns[self.as_path_offsets[row]:self.as_path_offsets[row + 1]]
+
+    def match(self, pattern, rows, deadline=None) -> array:
+        # rows whose AS-path matches a compiled aspath_pattern(); raises ValueError
+        # once time() passes the deadline
+        asns = self.as_path_asns
+        offsets = self.as_path_offsets
+        matched = array('I')
+        for checked, row in enumerate(rows):
+            if deadline and not checked % 1024 and time() > deadline:
+                raise ValueError('The AS-path regex takes too long, give an ASN it has to contain')
+            if pattern.search(' '.join(map(str, asns[offsets[row]:offsets[row + 1]]))):
+                matched.append(row)
+        return matched
+
+
+class RouteIndex:
+    # the paths of a service/family on every route server, indexed by
+    # community, origin AS and any AS of the AS-path
+    #
+    # the index is kept per peer, so a refresh replaces only the peers whose
+    # sessions changed since their paths were pulled
+
+    def __init__(self, service, ip_version):
+        self.service = service
+        self.ip_version = ip_version
+
+        self.peers = {}  # (rs, peer_id) -> PeerRoutes
+        self.inverted = {kind: {} for kind in INDEX_KINDS}  # kind -> key -> {(rs, peer_id): array of rows}
+        self.built = {}  # rs -> time of the last full table pull
+        self.updated = None
+
+        self._lock = Lock()
+
+    def __len__(self):
+        return sum(len(peer_routes) for peer_routes in self.peers.values())
+
+    @staticmethod
+    def _stamp(peer):
+        return peer.state, peer.last_event_time, peer.imported_routes, peer.preferred_routes
+
+    def replace_peer(self, peer_routes):
+        key = (peer_routes.rs, peer_routes.peer_id)
+        with self._lock:
+            self._drop(key)
+            self.peers[key] = peer_routes
+            for kind, rows_by_key in peer_routes.rows.items():
+                inverted = self.inverted[kind]
+                for index_key, rows in rows_by_key.items():
+                    inverted.setdefault(index_key, {})[key] = rows
+
+    def drop_peer(self, rs, peer_id):
+        with self._lock:
+            self._drop((rs, peer_id))
+
+    def _drop(self, key):
+        peer_routes = self.peers.pop(key, None)
+        if peer_routes is None:
+            return
+        for kind, rows_by_key in peer_routes.rows.items():
+            inverted = self.inverted[kind]
+            for index_key in rows_by_key:
+                announcers = inverted[index_key]
+                del announcers[key]
+                if not announcers:
+                    del inverted[index_key]
+
+    def refresh(self, rs, route_server, full=False):
+        # pulls the whole table once, then only the peers whose sessions changed
+        peers = {peer.peer_id: peer for peer in route_server.peers(service=self.service, ip_version=self.ip_version)}
+        if not peers:
+            # the route server is not reachable, keep what we have
+            return
+
+        if full or rs not in self.built:
+            self._pull_table(rs, route_server, peers)
+        else:
+            self._pull_changed(rs, route_server, peers)
+
+        self.updated = time()
+
+    def _pull_table(self, rs, route_server, peers):
+        # every path is reduced as soon as it is parsed, see PeerPaths
+        paths_by_peer = {}
+        for path in route_server.table(service=self.service, ip_version=self.ip_version):
+            peer_paths = paths_by_peer.get(path.peer_id)
+            if peer_paths is None:
+                peer_paths = paths_by_peer[path.peer_id] = PeerPaths()
+            peer_paths.add(path)
+
+        for peer_id, paths in paths_by_peer.items():
+            peer = peers.get(peer_id)
+            stamp = self._stamp(peer) if peer else None
+            self.replace_peer(PeerRoutes(rs, peer_id, stamp, paths))
+
+        for index_rs, peer_id in list(self.peers):
+            if index_rs == rs and peer_id not in paths_by_peer:
+                self.drop_peer(rs, peer_id)
+
+        self.built[rs] = time()
+
+    def _pull_changed(self, rs, route_server, peers):
+        for peer_id, peer in peers.items():
+            stamp = self._stamp(peer)
+            peer_routes = self.peers.get((rs, peer_id))
+            if peer_routes is not None and peer_routes.stamp == stamp:
+                continue
+
+            paths = []
+            if peer.state == 'up' and peer.imported_routes:
+                paths = route_server.protocol_routes(peer_id, service=self.service, ip_version=self.ip_version)
+            self.replace_peer(PeerRoutes(rs, peer_id, stamp, PeerPaths(paths)))
+
+        for index_rs, peer_id in list(self.peers):
+            if index_rs == rs and peer_id not in peers:
+                self.drop_peer(rs, peer_id)
+
+    def records(self, rs):
+        # (prefix, next_hop, as_path) of every path on a route server
+        with self._lock:
+            peers = [peer_routes for (index_rs, peer_id), peer_routes in self.peers.items() if index_rs == rs]
+
+        for peer_routes in peers:
+            yield from self._records(peer_routes)
+
+    def peer_records(self, rs, peer_id):
+        # same as records(), of one peer; None when the peer is not in the index
+        with self._lock:
+            peer_routes = self.peers.get((rs, peer_id))
+
+        if peer_routes is None:
+            return None
+        return self._records(peer_routes)
+
+    @staticmethod
+    def _records(peer_routes):
+        for row, (prefix, next_hop) in enumerate(zip(peer_routes.prefixes, peer_routes.next_hops)):
+            yield prefix, next_hop, tuple(peer_routes.as_path(row))
+
+    def search(self, kind, key, rs=None, after=None) -> (int, iter):
+        # (paths found, iterator of (prefix, [(rs, peer_id, as_path), ...])) in prefix order,
+        # starting after the `after` prefix; kind is one of INDEX_KINDS
+        with self._lock:
+            announcers = [(announcer, self.peers[announcer], rows)
+                          for announcer, rows in self.inverted[kind].get(key, {}).items()
+                          if rs is None or announcer[0] == rs]
+
+        found = sum(len(rows) for announcer, peer_routes, rows in announcers)
+        return found, self._merge(announcers, after)
+
+    def search_regex(self, text, rs=None, after=None, timeout=None) -> (int, iter):
+        # same as search(), for paths whose AS-path matches an aspath_pattern(),
+        # ValueError when the paths are not matched within timeout seconds
+        pattern = aspath_pattern(text)
+        deadline = time() + timeout if timeout else None
+        required = required_asns(text)
+
+        with self._lock:
+            if required:
+                # the least announced required ASN gives the fewest paths to check
+                inverted = self.inverted['asn']
+                rarest = min(required, key=lambda asn: sum(map(len, inverted.get(asn, {}).values())))
+                candidates = [(announcer, self.peers[announcer], rows)
+                              for announcer, rows in inverted.get(rarest, {}).items()]
+            else:
+                candidates = [(announcer, peer_routes, range(len(peer_routes)))
+                              for announcer, peer_routes in self.peers.items()]
+
+        announcers = []
+        for announcer, peer_routes, rows in candidates:
+            if rs is not None and announcer[0] != rs:
+                continue
+            matched = peer_routes.match(pattern, rows, deadline)
+            if matched:
+                announcers.append((announcer, peer_routes, matched))
+
+        found = sum(len(rows) for announcer, peer_routes, rows in announcers)
+        return found, self._merge(announcers, after)
+
+    @staticmethod
+    def _first_row_after(prefixes, rows, after_key) -> int:
+        # position of the first row with a prefix after after_key, rows are in prefix order
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            if prefix_key(prefixes[rows[middle]]) <= after_key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _merge(self, announcers, after=None):
+        # rows of every announcer are already in prefix order, so a k-way merge
+        # yields prefixes lazily instead of collecting every matching path first
+        after_key = prefix_key(after) if after else None
+
+        streams = []
+        for announcer, peer_routes, rows in sorted(announcers, key=lambda item: item[0]):
+            start = self._first_row_after(peer_routes.prefixes, rows, after_key) if after_key else 0
+            streams.append(self._stream(announcer, peer_routes, rows, start))
+
+        for prefix, items in groupby(heapq.merge(*streams), key=lambda item: item[1]):
+            yield prefix, [(rs, peer_id, list(peer_routes.as_path(row)))
+                           for sort_key, prefix, (rs, peer_id), row, peer_routes in items]
+
+    @staticmethod
+    def _stream(announcer, peer_routes, rows, start):
+        prefixes = peer_routes.prefixes
+        for row in rows[start:]:
+            prefix = prefixes[row]
+            # (prefix, announcer, row) is unique, peer_routes itself is never compared
+            yield prefix_key(prefix), prefix, announcer, row, peer_routes
+
+
+class RouteIndexes:
+    # a RouteIndex per service/family, refreshed in the background once somebody asks for it
+
+    def __init__(self, route_servers, interval=600, full_every=24):
+        self.route_servers = route_servers  # {'rs1': RouteServer, 'rs2': RouteServer}
+        self.interval = interval
+        self.full_every = full_every
+
+        self._indexes = {}
+        self._lock = Lock()
+
+    def get(self, service, ip_version) -> RouteIndex:
+        key = (service, ip_version)
+        with self._lock:
+            if key not in self._indexes:
+                self._indexes[key] = RouteIndex(service, ip_version)
+                Thread(target=self._refresh, args=[self._indexes[key]], daemon=True).start()
+            return self._indexes[key]
+
+    def find(self, service, ip_version):
+        # same as get(), but None instead of starting an index nobody asked for yet
+        with self._lock:
+            return self._indexes.get((service, ip_version))
+
+    def _refresh(self, index):
+        cycle = 0
+        while True:
+            full = cycle % self.full_every == 0
+            cycle += 1
+            for rs, route_server in self.route_servers.items():
+                try:
+                    index.refresh(rs, route_server, full=full)
+                except Exception:
+                    # keep refreshing, the route server may come back
+                    logging.exception('%s %s ipv%s index refresh failed', rs, index.service, index.ip_version)
+            sleep(self.interval)